@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Bulk ingestion of daily mandi prices from the Agmarknet open-data API
+
+Each arrival date is fetched as fixed-size pages requested concurrently
+over one pooled HTTP session. Every page is schema-checked and staged to
+disk as soon as it arrives, with a checkpoint listing finished offsets, so
+an interrupted run resumes where it stopped. When all pages of a day are
+in, the day is written to the price store as one snapshot, under the store's
+lock, so an app serving the same store (PRICE_STORE_PATH) shows the new rows
+on its next page view. Price forecasts are refitted once at the end of the
+run if any rows were written.
+
+    python agmarknet_ingest.py --start 2025-09-01 --end 2025-09-12
+    python agmarknet_mock_server.py --port 8765 &
+    python agmarknet_ingest.py --date 2025-09-12 --api-url http://127.0.0.1:8765/resource
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from crop_data import write_json_atomic
+from price_alerts import DEFAULT_ALERTS_PATH, PriceAlerts
+from price_data import ARRIVAL_DATE_FORMAT, PRICE_COLUMNS, compact_price_frame
+from price_forecast import refresh_forecasts
+from price_store import DEFAULT_STORE_PATH, PriceStore
+
+# Daily market prices of commodities (data.gov.in, Agmarknet)
+AGMARKNET_RESOURCE = '9ef84268-d588-465a-a308-a864a43d0070'
+AGMARKNET_API_URL = f"https://api.data.gov.in/resource/{AGMARKNET_RESOURCE}"
+
+PAGE_LIMIT = 1000
+DEFAULT_WORKERS = 8
+REQUEST_TIMEOUT = 30
+
+# API record fields and the agmarknet_prices.csv columns they map to
+FIELD_COLUMNS = {
+    'state': 'State', 'district': 'District', 'market': 'Market', 'commodity': 'Commodity',
+    'variety': 'Variety', 'grade': 'Grade', 'arrival_date': 'Arrival_Date',
+    'min_price': 'Min_x0020_Price', 'max_price': 'Max_x0020_Price', 'modal_price': 'Modal_x0020_Price',
+}
+
+
+class SchemaError(ValueError):
+    """An API page whose records do not have the expected fields"""
+
+
+def make_session(pool_size=DEFAULT_WORKERS, retries=3):
+    """requests.Session with a connection pool sized for the workers and retry with backoff"""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_page(session, api_url, api_key, day, offset, limit=PAGE_LIMIT):
+    """One page of API records for an arrival date; returns the decoded JSON body"""
+    params = {'api-key': api_key, 'format': 'json', 'offset': offset, 'limit': limit,
+              'filters[arrival_date]': day.strftime(ARRIVAL_DATE_FORMAT)}
+    response = session.get(api_url, params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def validate_records(records):
+    """API records as price CSV columns; returns (frame, rows dropped as invalid)
+
+    Raises SchemaError when a field is missing from the page altogether.
+    """
+    frame = pd.DataFrame.from_records(records)
+    if frame.empty:
+        return pd.DataFrame(columns=list(FIELD_COLUMNS.values())), 0
+    frame.columns = [column.lower() for column in frame.columns]
+    missing = sorted(set(FIELD_COLUMNS) - set(frame.columns))
+    if missing:
+        raise SchemaError(f"Agmarknet records are missing fields: {', '.join(missing)}")
+    frame = frame[list(FIELD_COLUMNS)].rename(columns=FIELD_COLUMNS)
+    for column in PRICE_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    dates = pd.to_datetime(frame['Arrival_Date'], format=ARRIVAL_DATE_FORMAT, errors='coerce')
+    text = frame[['State', 'Market', 'Commodity']].apply(lambda column: column.astype(str).str.strip() != '')
+    valid = frame[PRICE_COLUMNS].notna().all(axis=1) & dates.notna() & text.all(axis=1)
+    frame = frame[valid].copy()
+    frame[PRICE_COLUMNS] = frame[PRICE_COLUMNS].round().astype('int64')
+    return frame, int((~valid).sum())
+
+
+class DayIngest:
+    """Checkpointed download of one arrival date
+
+    Pages are staged as page-<offset>.csv under the checkpoint directory and
+    finished offsets are listed in checkpoint.json; a rerun fetches only the
+    offsets that are missing.
+    """
+
+    def __init__(self, directory, day, limit=PAGE_LIMIT):
+        self.directory = directory
+        self.day = day
+        self.limit = limit
+        self.checkpoint_path = os.path.join(directory, 'checkpoint.json')
+        self._lock = threading.Lock()
+        self.state = {'date': day.strftime('%Y-%m-%d'), 'limit': limit, 'total': None, 'done': [], 'dropped': 0}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                saved = json.load(f)
+            if saved.get('limit') == limit:
+                self.state = saved
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def offsets(self):
+        total = self.state['total'] or 0
+        return list(range(0, total, self.limit))
+
+    @property
+    def pending(self):
+        done = set(self.state['done'])
+        return [offset for offset in self.offsets if offset not in done]
+
+    def page_path(self, offset):
+        return os.path.join(self.directory, f"page-{offset:09d}.csv")
+
+    def save_page(self, offset, frame, dropped, total):
+        """Stage a validated page and record it in the checkpoint"""
+        path = self.page_path(offset)
+        frame.to_csv(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+        with self._lock:
+            self.state['total'] = total
+            self.state['done'] = sorted(set(self.state['done']) | {offset})
+            self.state['dropped'] += dropped
+            write_json_atomic(self.checkpoint_path, self.state)
+
+    def staged_frame(self):
+        """All staged pages of the day, in offset order"""
+        frames = [pd.read_csv(path, dtype=str, keep_default_na=False)
+                  for path in sorted(glob.glob(os.path.join(self.directory, 'page-*.csv')))]
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return pd.DataFrame(columns=list(FIELD_COLUMNS.values()))
+        frame = pd.concat(frames, ignore_index=True)
+        frame[PRICE_COLUMNS] = frame[PRICE_COLUMNS].astype('int64')
+        return frame
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def ingest_day(store, day, session, api_url, api_key, workers=DEFAULT_WORKERS, limit=PAGE_LIMIT,
+               checkpoint_root=None, record_dir=None):
+    """Fetch every page for one arrival date and add it to the store; returns a stats dict"""
+    started = time.perf_counter()
+    checkpoint_root = checkpoint_root or os.path.join(store.root, 'ingest_checkpoints')
+    job = DayIngest(os.path.join(checkpoint_root, day.strftime('%Y-%m-%d')), day, limit)
+    fetched = 0
+    retried = 0
+
+    def fetch(offset):
+        body = fetch_page(session, api_url, api_key, day, offset, limit)
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+            write_json_atomic(os.path.join(record_dir, f"{day:%Y-%m-%d}-{offset:09d}.json"), body)
+        frame, dropped = validate_records(body.get('records', []))
+        job.save_page(offset, frame, dropped, int(body.get('total', 0)))
+        return len(frame)
+
+    # The first page tells us how many records, and so pages, the day has
+    if job.state['total'] is None:
+        fetch(0)
+        fetched += 1
+    pending = job.pending
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch, offset): offset for offset in pending}
+        failed = []
+        for future in as_completed(futures):
+            try:
+                future.result()
+                fetched += 1
+            except SchemaError:
+                raise
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"Agmarknet page error ({day:%Y-%m-%d} offset {futures[future]}): {e}")
+    # Requests already retry transient HTTP errors; give failed pages one more sequential pass
+    for offset in failed:
+        fetch(offset)
+        fetched += 1
+        retried += 1
+
+    frame = job.staged_frame()
+    counts = {'added': 0, 'changed': 0, 'skipped': 0}
+    if len(frame):
+        source = hashlib.sha256(pd.util.hash_pandas_object(frame, index=False).values.tobytes()).hexdigest()
+        result = store.ingest_frame(compact_price_frame(frame), f"agmarknet-{day:%Y%m%d}-{source[:32]}",
+                                    f"{api_url} {day:%Y-%m-%d}")
+        counts = {key: result[key] for key in counts}
+    job.clear()
+    elapsed = time.perf_counter() - started
+    return dict(counts, date=f"{day:%Y-%m-%d}", records=job.state['total'] or 0, rows=len(frame),
+                dropped=job.state['dropped'], pages=len(job.offsets), fetched=fetched, retried=retried,
+                seconds=elapsed, rows_per_s=len(frame) / elapsed if elapsed else 0.0)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--date', help='single arrival date, YYYY-MM-DD')
+    parser.add_argument('--start', help='first arrival date, YYYY-MM-DD')
+    parser.add_argument('--end', help='last arrival date, YYYY-MM-DD (default: today)')
+    parser.add_argument('--store', default=os.getenv('PRICE_STORE_PATH', DEFAULT_STORE_PATH),
+                        help='price store directory (default: PRICE_STORE_PATH, as served by the app)')
+    parser.add_argument('--api-url', default=os.getenv('AGMARKNET_API_URL', AGMARKNET_API_URL))
+    parser.add_argument('--api-key', default=os.getenv('DATA_GOV_API_KEY', ''),
+                        help='data.gov.in API key (default: DATA_GOV_API_KEY)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='concurrent page requests')
+    parser.add_argument('--limit', type=int, default=PAGE_LIMIT, help='records per page')
+    parser.add_argument('--record', help='also save raw API pages here for agmarknet_mock_server.py')
+    parser.add_argument('--forecast-workers', type=int,
+                        help='processes for the forecast refit after ingesting (default: FORECAST_WORKERS or CPU count)')
+    parser.add_argument('--alerts', default=DEFAULT_ALERTS_PATH, help='price alert database to match new rows against')
+    args = parser.parse_args()
+
+    if args.date:
+        days = [pd.Timestamp(args.date)]
+    elif args.start:
+        days = list(pd.date_range(args.start, args.end or pd.Timestamp.today().normalize(), freq='D'))
+    else:
+        parser.error('pass --date or --start')
+
+    store = PriceStore(args.store)
+    version = store.version
+    alerts = PriceAlerts(args.alerts).attach(store)
+    session = make_session(args.workers)
+    total_rows = 0
+    started = time.perf_counter()
+    for day in days:
+        try:
+            stats = ingest_day(store, day, session, args.api_url, args.api_key, args.workers, args.limit,
+                               record_dir=args.record)
+        except Exception as e:
+            # The day's checkpoint is kept, so a rerun resumes it
+            print(f"{day:%Y-%m-%d}: ingest error: {e}")
+            continue
+        total_rows += stats['rows']
+        print(f"{stats['date']}: {stats['rows']:,} rows from {stats['pages']} pages "
+              f"({stats['added']:,} added, {stats['changed']:,} changed, {stats['skipped']:,} skipped, "
+              f"{stats['dropped']} invalid) in {stats['seconds']:.2f}s, {stats['rows_per_s']:,.0f} rows/s")
+    alerts.flush()
+    elapsed = time.perf_counter() - started
+    print(f"Price alerts: {alerts.stats()}")
+    print(f"Ingested {total_rows:,} rows over {len(days)} days in {elapsed:.1f}s; {store.describe()}")
+    if store.version != version:
+        refresh_forecasts(store, workers=args.forecast_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Agmarknet open-data API
+
+Serves the same paginated JSON as api.data.gov.in from recorded pages
+(saved with agmarknet_ingest.py --record) or from a price CSV, so the
+ingestion pipeline and its throughput can be tested offline. Latency and
+transient failures can be injected.
+
+    python agmarknet_mock_server.py --port 8765 --csv agmarknet_prices.csv
+    python agmarknet_mock_server.py --port 8765 --pages recorded_pages/ --delay 0.05 --fail-rate 0.1
+    python agmarknet_mock_server.py --check
+"""
+
+import argparse
+import glob
+import json
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from agmarknet_ingest import FIELD_COLUMNS
+
+
+def records_from_csv(path):
+    """API-style records (lower-case fields, string values) from a price CSV"""
+    frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+    frame = frame.rename(columns={column: field for field, column in FIELD_COLUMNS.items()})
+    return frame[list(FIELD_COLUMNS)].to_dict('records')
+
+
+def records_from_pages(directory):
+    """Records from JSON pages recorded by agmarknet_ingest.py --record, in file order"""
+    records = []
+    for path in sorted(glob.glob(f"{directory}/*.json")):
+        with open(path) as f:
+            records.extend(json.load(f).get('records', []))
+    return records
+
+
+class MockAgmarknet:
+    """Records grouped by arrival date, served in offset/limit pages"""
+
+    def __init__(self, records, delay=0.0, fail_rate=0.0, seed=0):
+        self.by_date = {}
+        for record in records:
+            self.by_date.setdefault(record['arrival_date'], []).append(record)
+        self.all_records = list(records)
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def page(self, query):
+        """(status, body) for a request's query parameters"""
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.fail_rate
+            self.failures += fail
+        if self.delay:
+            time.sleep(self.delay)
+        if fail:
+            return 503, {'error': 'injected failure'}
+        day = query.get('filters[arrival_date]', [None])[0]
+        records = self.by_date.get(day, []) if day else self.all_records
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', ['10'])[0])
+        page = records[offset:offset + limit]
+        return 200, {'status': 'ok', 'total': len(records), 'count': len(page), 'limit': str(limit),
+                     'offset': str(offset), 'records': page}
+
+
+def make_server(api, host='127.0.0.1', port=0):
+    """ThreadingHTTPServer answering GET /resource... from a MockAgmarknet"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = api.page(parse_qs(urlparse(self.path).query))
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_server(api, host='127.0.0.1', port=0):
+    """Serve api on a background thread; returns (server, base URL)"""
+    server = make_server(api, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/resource"
+
+
+def check_reingest(records, changes=5):
+    """Ingest one arrival date twice through the mock API, changing a few prices in between
+
+    Regression check for same-day re-ingests: every row of the day must still
+    be queryable afterwards, with the changed prices winning. Raises
+    AssertionError on a mismatch and returns the second ingest's stats.
+    """
+    from agmarknet_ingest import ingest_day, make_session
+    from price_store import PriceStore
+
+    api = MockAgmarknet(records)
+    day = max(api.by_date, key=lambda key: len(api.by_date[key]))
+    server, url = start_server(api)
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            store = PriceStore(root)
+            session = make_session(2)
+            arrival = pd.Timestamp(pd.to_datetime(day, format='%d/%m/%Y'))
+            first = ingest_day(store, arrival, session, url, 'test', workers=2)
+            before = store.query()
+            for record in api.by_date[day][:changes]:
+                record['modal_price'] = str(int(float(record['modal_price'])) + 1)
+            second = ingest_day(store, arrival, session, url, 'test', workers=2)
+            after = store.query()
+            files = [part['file'] for part in store.parts]
+            assert first['added'] == len(before), (first, len(before))
+            assert (second['added'], second['changed']) == (0, changes), second
+            assert len(after) == len(before), f"{len(after)} rows after re-ingest, {len(before)} before"
+            assert len(files) == len(set(files)), 'manifest lists a part file twice'
+            assert (after['Modal_x0020_Price'].sum() - before['Modal_x0020_Price'].sum()) == changes
+            return second
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--csv', default='agmarknet_prices.csv', help='price CSV to serve')
+    parser.add_argument('--pages', help='directory of recorded JSON pages to replay instead of --csv')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds of latency per request')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--check', action='store_true',
+                        help='run the same-day re-ingest regression check against a temporary store and exit')
+    args = parser.parse_args()
+
+    records = records_from_pages(args.pages) if args.pages else records_from_csv(args.csv)
+    if args.check:
+        stats = check_reingest(records)
+        print(f"Re-ingest check passed: {stats['changed']} changed, {stats['skipped']:,} skipped")
+        return
+    api = MockAgmarknet(records, args.delay, args.fail_rate)
+    server = make_server(api, args.host, args.port)
+    print(f"Serving {len(records):,} records for {len(api.by_date)} arrival dates "
+          f"at http://{args.host}:{args.port}/resource")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{api.requests:,} requests, {api.failures:,} injected failures")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import streamlit as st
 from datetime import datetime
 import pandas as pd
-import numpy as np
 import requests
 import os
 from dotenv import load_dotenv
@@ -9,6 +8,17 @@ from dotenv import load_dotenv
 from translate import Translator
 import openai
 import cohere
+from crop_data import file_fingerprint, load_crop_features
+from crop_engine import CropRecommender, OutOfCoreRecommender
+from recommendation_cache import RecommendationCache
+from price_data import PRICE_DATA_PATH, load_price_data
+from price_store import DEFAULT_STORE_PATH, PriceStore
+from price_forecast import INTERVAL_LEVEL, ForecastRefresher, forecast_dir, saved_forecasts
+from price_backtest import backtest_path, load_leaderboard
+from chart_downsample import DownsampleCache
+from crop_commodity import RevenueScorer, recommend_by_revenue
+from mandi_locations import MandiIndex, best_nearby
+from price_alerts import PriceAlerts, normalize_phone
 # Removed Twilio - using Deep AI instead
 # Removed Hugging Face transformers - using Deep AI instead
 TRANSFORMERS_AVAILABLE = False
@@ -59,7 +69,81 @@ FAMILY_NUMBERS = []  # Will be populated from farmer profile
 # ---------------------------
 # Load Crop Recommendation Data
 # ---------------------------
-df_crop = pd.read_csv('crop_recommendation.csv')
+CROP_DATA_PATH = 'crop_recommendation.csv'
+# Set CROP_OUT_OF_CORE=1 to stream the memory-mapped snapshot instead of indexing it in RAM
+CROP_OUT_OF_CORE = os.getenv('CROP_OUT_OF_CORE') == '1'
+# Nearest-neighbour engine: auto, brute, kdtree or sharded (CROP_ENGINE_WORKERS sets its thread count)
+CROP_ENGINE = os.getenv('CROP_ENGINE', 'auto')
+
+# Float32 feature matrix and label codes, shared by all sessions
+# (keyed on the file's size and mtime so an edited CSV is reloaded; versioned
+# getters keep one entry, so the previous version is freed rather than pinned)
+@st.cache_resource(max_entries=1)
+def get_crop_features(version=None):
+    return load_crop_features(CROP_DATA_PATH)
+
+# Nearest-neighbour index over the crop records, built once per process
+@st.cache_resource(max_entries=1)
+def get_crop_recommender(version=None):
+    if CROP_OUT_OF_CORE:
+        return OutOfCoreRecommender(get_crop_features(version))
+    return CropRecommender(get_crop_features(version), CROP_ENGINE)
+
+# Recommendation cache shared by all sessions and worker processes
+@st.cache_resource
+def get_recommendation_cache():
+    return RecommendationCache(source=CROP_DATA_PATH)
+
+# Date- and state-partitioned price history, shared with the ingest CLIs; the bundled
+# snapshot is added once per process and later snapshots come from price_store.py ingest
+# or agmarknet_ingest.py, never from a page view
+PRICE_STORE_PATH = os.getenv('PRICE_STORE_PATH', DEFAULT_STORE_PATH)
+
+# Price-threshold alert subscriptions, matched against every ingest into the store
+@st.cache_resource
+def get_price_alerts():
+    return PriceAlerts()
+
+@st.cache_resource
+def get_price_store():
+    store = PriceStore(PRICE_STORE_PATH)
+    get_price_alerts().attach(store)
+    # Forecasts are refitted on a background thread after each ingest, never during a page view
+    ForecastRefresher(store).attach()
+    try:
+        store.ingest_price_data(load_price_data(PRICE_DATA_PATH))
+    except Exception as e:
+        print(f"Price store ingest error: {e}")
+    return store
+
+# Last saved forecasts for every price series (keyed on the meta file's size and mtime)
+@st.cache_resource(max_entries=1)
+def get_price_forecasts(version=None):
+    return saved_forecasts(get_price_store())
+
+# Chart series downsampled to a fixed point budget, shared by all sessions
+CHART_POINTS = int(os.getenv('CHART_POINTS', 500))
+
+@st.cache_resource
+def get_chart_cache():
+    return DownsampleCache()
+
+# Accuracy leaderboard written by price_backtest.py (keyed on the file's size and mtime)
+@st.cache_resource(max_entries=1)
+def get_forecast_leaderboard(version=None):
+    return load_leaderboard(get_price_store())[0]
+
+# Crop label to commodity join and current price matrix, rebuilt when either dataset changes
+@st.cache_resource(max_entries=1)
+def get_revenue_scorer(crop_version=None, price_version=None):
+    return RevenueScorer(get_crop_features(crop_version).labels, load_price_data(PRICE_DATA_PATH).frame)
+
+# Located mandis and their latest prices per commodity, rebuilt when the price data changes
+NEARBY_MANDIS = int(os.getenv('NEARBY_MANDIS', 5))
+
+@st.cache_resource(max_entries=1)
+def get_mandi_index(version=None):
+    return MandiIndex(load_price_data(PRICE_DATA_PATH).frame)
 
 # Sample Data for other sections
 crop_data = {
@@ -70,13 +154,27 @@ crop_data = {
 
 # Crop recommendation function
 def recommend_crop(N, P, K, temperature, humidity, ph, rainfall, state):
-    # Filter by state if needed, but for simplicity, use all data
-    conditions = np.array([N, P, K, temperature, humidity, ph, rainfall])
-    distances = np.sqrt(np.sum((df_crop[['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']] - conditions) ** 2, axis=1))
-    closest_indices = distances.nsmallest(3).index
-    recommended_crops = df_crop.iloc[closest_indices]['label'].tolist()
-    confidences = [max(0, min(100, 100 - distances[i] / 10)) for i in closest_indices]
-    return recommended_crops, confidences
+    # Searches only the selected state's records; unknown states use all data.
+    # Returns distinct crops, so the three slots are never the same label.
+    recommender = get_crop_recommender(file_fingerprint(CROP_DATA_PATH))
+    return get_recommendation_cache().recommend(recommender, N, P, K, temperature, humidity, ph, rainfall, state,
+                                                distinct=True)
+
+# Batch crop recommendation for bulk soil test results (array or DataFrame of conditions)
+def recommend_crop_batch(conditions, states=None, k=3):
+    return get_crop_recommender(file_fingerprint(CROP_DATA_PATH)).recommend_batch(conditions, states, k)
+
+# Nearest distinct crops re-ranked by confidence x current modal price in the state
+def recommend_crop_by_revenue(N, P, K, temperature, humidity, ph, rainfall, state, k=3):
+    version = file_fingerprint(CROP_DATA_PATH)
+    recommender = get_crop_recommender(version)
+    scorer = get_revenue_scorer(version, load_price_data(PRICE_DATA_PATH).sha256)
+
+    def recommend(N, P, K, temperature, humidity, ph, rainfall, state, k):
+        return get_recommendation_cache().recommend(recommender, N, P, K, temperature, humidity, ph, rainfall, state,
+                                                    k, distinct=True)
+
+    return recommend_by_revenue(recommend, scorer, N, P, K, temperature, humidity, ph, rainfall, state, k)
 
 # Weather function
 def get_weather(city):
@@ -1260,6 +1358,7 @@ st.markdown("---")
 st.sidebar.subheader("👨‍🌾 " + get_text("farmer_profile", global_lang))
 farmer_name = st.sidebar.text_input(get_text("farmer_name", global_lang), key="farmer_name")
 farmer_age = st.sidebar.number_input(get_text("age", global_lang), min_value=18, max_value=100, value=30, key="farmer_age")
+farmer_phone = st.sidebar.text_input(get_text("phone", global_lang), key="farmer_phone")
 st.sidebar.subheader(get_text("emergency_contacts", global_lang))
 family1_name = st.sidebar.text_input(get_text("family_member_1", global_lang), key="family1_name")
 family1_phone = st.sidebar.text_input(get_text("phone", global_lang), key="family1_phone")
@@ -1272,9 +1371,12 @@ if st.sidebar.button(get_text("save_profile", global_lang)):
     st.session_state.farmer_profile = {
         "name": farmer_name,
         "age": farmer_age,
+        "phone": normalize_phone(farmer_phone),
         "family1": {"name": family1_name, "phone": family1_phone},
         "family2": {"name": family2_name, "phone": family2_phone}
     }
+    if farmer_phone and not st.session_state.farmer_profile["phone"]:
+        st.sidebar.warning("Enter a 10-digit mobile number to get price alerts")
     # Update global FAMILY_NUMBERS variable
     FAMILY_NUMBERS = get_family_numbers(st.session_state.farmer_profile)
 
@@ -1284,11 +1386,15 @@ if st.sidebar.button(get_text("save_profile", global_lang)):
 if menu == get_text("menu_dashboard", global_lang):
     st.subheader("💹 " + get_text("market_dashboard", global_lang))
 
-    # Load price data
-    df_prices = pd.read_csv('agmarknet_prices.csv')
+    # Shared price data, parsed once per process
+    price_data = load_price_data(PRICE_DATA_PATH)
+    st.caption(price_data.describe())
+
+    # Aggregates are materialized at load time and refreshed per ingest
+    aggregates = price_data.aggregates
 
-    # Get top 10 commodities by modal price
-    top_commodities = df_prices.nlargest(10, 'Modal_x0020_Price')[['Commodity', 'Modal_x0020_Price', 'State', 'Market', 'District']].drop_duplicates(subset=['Commodity'])
+    # Top 10 distinct commodities, each with its best market
+    top_commodities = aggregates.top_commodities(10)
 
     st.write(f"### {get_text('top_commodities', global_lang)}")
     for i, (_, row) in enumerate(top_commodities.iterrows(), 1):
@@ -1297,14 +1403,14 @@ if menu == get_text("menu_dashboard", global_lang):
     st.write(f"### {get_text('market_insights', global_lang)}")
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric(get_text("total_commodities", global_lang), len(df_prices['Commodity'].unique()))
+        st.metric(get_text("total_commodities", global_lang), aggregates.commodity_total)
     with col2:
-        st.metric(get_text("avg_price", global_lang), f"₹{int(df_prices['Modal_x0020_Price'].mean())}")
+        st.metric(get_text("avg_price", global_lang), f"₹{int(aggregates.average_price)}")
     with col3:
-        st.metric(get_text("states_covered", global_lang), len(df_prices['State'].unique()))
+        st.metric(get_text("states_covered", global_lang), aggregates.state_total)
 
     st.write(f"### {get_text('price_trends', global_lang)}")
-    st.bar_chart(df_prices.groupby('Commodity')['Modal_x0020_Price'].mean().nlargest(10))
+    st.bar_chart(aggregates.top_mean_prices(10))
 
 # ---------------------------
 # Crop Recommendation
@@ -1325,14 +1431,25 @@ elif menu == get_text("menu_crop_rec", global_lang):
         humidity = st.slider(get_text("humidity", global_lang), 14, 100, 60)
         rainfall = st.slider(get_text("rainfall", global_lang), 20, 300, 100)
         soil_type = st.selectbox(get_text("soil_type", global_lang), ["Sandy", "Clay", "Loam", "Silt", "Peat", "Chalk"])
-        state = st.selectbox(get_text("state", global_lang), df_crop['State'].unique())
+        state = st.selectbox(get_text("state", global_lang), get_crop_recommender(file_fingerprint(CROP_DATA_PATH)).states)
 
     if st.button(get_text("get_recommendation", global_lang)):
-        recommended_crops, confidences = recommend_crop(N, P, K, temperature, humidity, ph, rainfall, state)
+        recommended_crops, confidences, partition = recommend_crop(N, P, K, temperature, humidity, ph, rainfall, state)
 
         st.write(f"### {get_text('top_3_crops', global_lang)}")
         for i, (crop, conf) in enumerate(zip(recommended_crops, confidences), 1):
             st.write(f"{i}. **{crop}** - {get_text('confidence', global_lang)}: {conf:.1f}%")
+        st.caption(f"Based on crop records for: {partition}")
+
+        # Revenue-aware ranking: the same neighbours weighted by current mandi prices
+        ranked, _ = recommend_crop_by_revenue(N, P, K, temperature, humidity, ph, rainfall, state)
+        st.write("### Ranked by Expected Price")
+        for i, row in enumerate(ranked.itertuples(index=False), 1):
+            if pd.isna(row.modal_price):
+                st.write(f"{i}. **{row.crop}** - {get_text('confidence', global_lang)}: {row.confidence:.1f}% (no mandi price)")
+            else:
+                st.write(f"{i}. **{row.crop}** - {get_text('confidence', global_lang)}: {row.confidence:.1f}%, "
+                         f"{row.commodity} ₹{row.modal_price:,.0f}/quintal ({row.price_scope})")
 
         # Irrigation Recommendation
         st.write(f"### {get_text('irrigation_rec', global_lang)}")
@@ -1467,11 +1584,22 @@ elif menu == get_text("menu_crop_rec", global_lang):
 elif menu == get_text("menu_price", global_lang):
     st.subheader("💹 " + get_text("live_price_info", global_lang))
 
-    # Load price data
-    df = pd.read_csv('agmarknet_prices.csv')
+    # Shared price data, parsed once per process
+    price_data = load_price_data(PRICE_DATA_PATH)
+    price_index = price_data.index
+    st.caption(price_data.describe())
+    price_store = get_price_store()
+    # Reloads the manifest if agmarknet_ingest.py or price_store.py ingested since the last view
+    store_version = price_store.version
+    forecast_meta = os.path.join(forecast_dir(price_store), 'meta.json')
+    price_forecasts = get_price_forecasts(
+        file_fingerprint(forecast_meta) if os.path.exists(forecast_meta) else None)
+    leaderboard_path = backtest_path(price_store)
+    forecast_leaderboard = get_forecast_leaderboard(
+        file_fingerprint(leaderboard_path) if os.path.exists(leaderboard_path) else None)
 
     # State selection - include all Indian states
-    available_states = sorted(df['State'].unique())
+    available_states = list(price_index.states)
     all_indian_states = [
         'Andhra Pradesh', 'Arunachal Pradesh', 'Assam', 'Bihar', 'Chhattisgarh', 'Goa', 'Gujarat',
         'Haryana', 'Himachal Pradesh', 'Jharkhand', 'Karnataka', 'Kerala', 'Madhya Pradesh',
@@ -1492,10 +1620,9 @@ elif menu == get_text("menu_price", global_lang):
     selected_state = st.selectbox(get_text("select_state", global_lang), available_states)
 
     # Filter crops by state and limit to 500
-    if selected_state in df['State'].values:
-        state_crops = df[df['State'] == selected_state]['Commodity'].unique()
-        # Sort and limit to 500 crops
-        available_crops = sorted(state_crops)[:500]
+    if price_index.has_state(selected_state):
+        # Sorted commodities for the state, limited to 500 crops
+        available_crops = price_index.commodities(selected_state)[:500]
     else:
         # For states not in data, show comprehensive list of crops (expanded to ~500)
         available_crops = [
@@ -1592,26 +1719,95 @@ elif menu == get_text("menu_price", global_lang):
     crop_choice = st.selectbox(get_text("select_crop", global_lang), available_crops)
 
     # Get price data for selected crop and state
-    crop_prices = df[(df['Commodity'] == crop_choice) & (df['State'] == selected_state)]
+    crop_prices = price_index.rows(selected_state, crop_choice)
     if not crop_prices.empty:
-        # Show current modal price
-        current_price = crop_prices['Modal_x0020_Price'].iloc[0]
+        # The farmer's district locates them; the best-paying of the nearest mandis trading the crop is shown
+        mandi_index = get_mandi_index(price_data.sha256)
+        districts = mandi_index.districts(selected_state)
+        nearby = pd.DataFrame()
+        if districts:
+            home_district = st.selectbox("Your District", districts)
+            location = mandi_index.locate(selected_state, home_district)
+            if location is not None:
+                nearby = mandi_index.nearest(*location, crop_choice, NEARBY_MANDIS)
+        best = best_nearby(nearby)
+        if best is None:
+            # No located mandis: fall back to the state's most recent report
+            best = crop_prices.loc[crop_prices['Arrival_Date'].idxmax()]
+
+        current_price = int(best['Modal_x0020_Price'])
+        market, district, market_state = best['Market'], best['District'], best['State']
         st.metric(f"Current Modal Price for {crop_choice}", f"₹{current_price}")
-
-        # Show price range
-        min_price = crop_prices['Min_x0020_Price'].iloc[0]
-        max_price = crop_prices['Max_x0020_Price'].iloc[0]
-        st.write(f"**Price Range:** ₹{min_price} - ₹{max_price}")
-
-        # Show market information
-        market = crop_prices['Market'].iloc[0]
-        district = crop_prices['District'].iloc[0]
-        st.write(f"**Market:** {market}, {district}, {selected_state}")
-
-        # Simple forecast (placeholder)
-        st.markdown("### Price Forecast (Sample)")
-        forecast_prices = [current_price * (1 + 0.05 * (i/30)) for i in range(30)]
-        st.line_chart(forecast_prices)
+        st.write(f"**Price Range:** ₹{best['Min_x0020_Price']} - ₹{best['Max_x0020_Price']}")
+        st.write(f"**Market:** {market}, {district}, {market_state}")
+
+        if len(nearby):
+            st.markdown("### Nearby Mandis")
+            st.dataframe(pd.DataFrame({
+                'Market': nearby['Market'] + ', ' + nearby['District'],
+                'Distance (km)': nearby['distance_km'].round(0).astype(int),
+                'Modal Price (₹)': nearby['Modal_x0020_Price'].astype(int),
+                'Reported': nearby['Arrival_Date'].dt.strftime('%d %b %Y'),
+            }), hide_index=True)
+            st.caption(f"Best modal price among the {len(nearby)} nearest mandis reporting {crop_choice} "
+                       f"(distances from district headquarters); {mandi_index.describe()}")
+
+        # Alerts on this mandi's price, delivered after the next ingest that crosses the threshold
+        with st.expander("🔔 Price Alerts"):
+            # Subscriptions belong to the phone number saved in the farmer profile
+            contact = st.session_state.get('farmer_profile', {}).get('phone')
+            price_alerts = get_price_alerts()
+            if not contact:
+                st.info("Save your phone number in the Farmer Profile to get price alerts")
+            col1, col2 = st.columns(2)
+            with col1:
+                direction = st.radio("Alert me when the price goes", ["above", "below"], horizontal=True)
+            with col2:
+                threshold = st.number_input("Threshold (₹/quintal)", min_value=0, value=current_price, step=50)
+            if st.button(f"Alert me about {crop_choice} at {market}", disabled=not contact):
+                price_alerts.subscribe(market, crop_choice, direction, threshold, contact)
+                st.success(f"We'll alert {contact} when {crop_choice} at {market} goes {direction} ₹{threshold:,}")
+            if contact:
+                subscriptions = price_alerts.book.subscriptions(contact)
+                if len(subscriptions):
+                    st.dataframe(subscriptions[['market', 'commodity', 'direction', 'threshold']], hide_index=True)
+                recent = price_alerts.book.alerts(contact, limit=10)
+                for alert in recent.itertuples(index=False):
+                    st.write(f"**{alert.commodity}** at {alert.market}: ₹{alert.price:,.0f} on {alert.arrival_date} "
+                             f"({alert.direction} ₹{alert.threshold:,.0f})")
+
+        # Daily history from the partitioned store (only this state's partitions are read),
+        # downsampled once per store version to at most CHART_POINTS points
+        history = get_chart_cache().get(
+            ('history', selected_state, crop_choice, store_version),
+            lambda: price_store.daily_prices(selected_state, crop_choice)['Modal_x0020_Price'],
+            CHART_POINTS)
+        if len(history) > 1:
+            st.markdown("### Price History")
+            st.line_chart(history)
+            st.caption(price_store.describe())
+
+        # Precomputed forecast for this market's series
+        forecast, model = (price_forecasts.forecast(market_state, market, crop_choice)
+                           if price_forecasts is not None else (None, None))
+        if forecast is not None:
+            st.markdown("### Price Forecast")
+            if forecast['lower'].notna().any():
+                st.line_chart(forecast)
+                st.caption(f"{len(forecast)}-day forecast from the {model} model with a "
+                           f"{INTERVAL_LEVEL:.0%} prediction interval")
+                if forecast_leaderboard is not None:
+                    scores = forecast_leaderboard[(forecast_leaderboard['commodity'] == crop_choice)
+                                                  & (forecast_leaderboard['model'] == model)]
+                    if len(scores):
+                        score = scores.iloc[0]
+                        st.caption(f"Backtested on {crop_choice}: MAPE {score['mape']:.1%}, "
+                                   f"{score['coverage']:.0%} of prices inside the interval")
+            else:
+                st.line_chart(forecast['forecast'])
+                st.caption("Not enough price history to fit a model yet; showing the latest price")
+        elif price_forecasts is None:
+            st.info("Price forecasts are being prepared and will appear once the next refit finishes.")
     else:
         # For states not in data, show sample prices
         sample_prices = {
@@ -1629,11 +1825,7 @@ elif menu == get_text("menu_price", global_lang):
         st.info("This is sample pricing data. Actual prices may vary by market and season.")
         st.write(f"**Sample Price Range:** ₹{int(current_price * 0.8)} - ₹{int(current_price * 1.2)}")
         st.write(f"**State:** {selected_state} (Sample Data)")
-
-        # Simple forecast (placeholder)
-        st.markdown("### Price Forecast (Sample)")
-        forecast_prices = [current_price * (1 + 0.05 * (i/30)) for i in range(30)]
-        st.line_chart(forecast_prices)
+        st.info("Price forecasts are available for markets with recorded price history.")
 
 # ---------------------------
 # Weather
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the crop recommendation hot path
+
+Runs single-query and batch recommendations against the bundled dataset and
+synthetic datasets from expand_crop_dataset.py, for every engine, and writes
+p50/p99 latency, queries/sec and each engine's own peak memory (RSS growth
+from just before its build) to a JSON file. Pass --compare with an earlier
+results file to flag regressions.
+
+    python benchmark_recommend.py --sizes 44600,1000000 --output bench.json
+    python benchmark_recommend.py --output bench.json --compare baseline.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from crop_data import FEATURE_COLUMNS, CropFeatures, load_crop_features
+from crop_engine import ENGINES, CropRecommender, OutOfCoreRecommender
+from expand_crop_dataset import GroupModel, generate_chunks
+from recommendation_cache import RecommendationCache
+
+DEFAULT_SIZES = [44600, 1000000, 10000000]
+BUNDLED_ROWS = 44600
+
+# Slider ranges from the Crop Recommendation page
+QUERY_RANGES = [(0, 140), (0, 145), (0, 205), (8, 44), (14, 100), (3.5, 9.9), (20, 300)]
+
+# The original pandas scan is O(n) per query with several temporaries,
+# so it is skipped above this size unless --pandas-max-rows says otherwise
+PANDAS_MAX_ROWS = 1000000
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss_mb():
+    """Resident set size of this process now, in MB, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class RssSampler:
+    """Peak RSS growth while a block runs, sampled on a background thread
+
+    The process-wide ru_maxrss only ever grows, so every engine after the
+    largest one would report that engine's footprint. Sampling the current
+    RSS from just before a run gives each run its own peak. Without /proc
+    the growth of ru_maxrss is used, which is 0 for runs below an earlier peak.
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        gc.collect()
+        self.start = current_rss_mb()
+        if self.start is None:
+            self.start = self.peak = peak_rss_mb()
+            return self
+        self.peak = self.start
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    @property
+    def delta_mb(self):
+        """Peak RSS above the starting level so far, in MB"""
+        now = current_rss_mb() if self._thread is not None else peak_rss_mb()
+        self.peak = max(self.peak, now)
+        return self.peak - self.start
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return False
+
+
+def make_queries(count, rng):
+    """Random slider-grid conditions: whole units, and 0.1 steps for pH"""
+    queries = np.empty((count, len(QUERY_RANGES)))
+    for j, (low, high) in enumerate(QUERY_RANGES):
+        if isinstance(low, float):
+            queries[:, j] = np.round(rng.uniform(low, high, count), 1)
+        else:
+            queries[:, j] = rng.integers(low, high + 1, count)
+    return queries
+
+
+def make_dataset(rows, seed):
+    """Bundled features for the bundled size, otherwise synthetic rows"""
+    if rows == BUNDLED_ROWS:
+        return load_crop_features('crop_recommendation.csv')
+    model = GroupModel(pd.read_csv('crop_recommendation.csv'))
+    chunks = list(generate_chunks(model, rows, seed=seed))
+    return CropFeatures(np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks]),
+                        model.labels, np.concatenate([c[2] for c in chunks]), model.states)
+
+
+class PandasBaseline:
+    """The original recommend_crop: a pandas distance over the whole frame"""
+
+    def __init__(self, features):
+        self.df_crop = pd.DataFrame(features.matrix.astype(np.float64), columns=FEATURE_COLUMNS)
+        self.df_crop['label'] = features.label_names(np.arange(len(features)))
+
+    def recommend(self, N, P, K, temperature, humidity, ph, rainfall, state=None, k=3):
+        conditions = np.array([N, P, K, temperature, humidity, ph, rainfall])
+        distances = np.sqrt(np.sum((self.df_crop[FEATURE_COLUMNS] - conditions) ** 2, axis=1))
+        closest_indices = distances.nsmallest(k).index
+        return self.df_crop.iloc[closest_indices]['label'].tolist()
+
+
+def latency_stats(samples):
+    samples = np.asarray(samples) * 1000
+    return {'p50_ms': float(np.percentile(samples, 50)), 'p99_ms': float(np.percentile(samples, 99)),
+            'qps': float(len(samples) / (samples.sum() / 1000))}
+
+
+def time_single(recommend, queries, states):
+    """Time recommend() one query at a time"""
+    samples = []
+    for query, state in zip(queries, states):
+        started = time.perf_counter()
+        recommend(*query, state)
+        samples.append(time.perf_counter() - started)
+    return latency_stats(samples)
+
+
+def time_batch(recommend_batch, queries, states):
+    """Time one recommend_batch() call over all queries"""
+    started = time.perf_counter()
+    recommend_batch(queries, states)
+    elapsed = time.perf_counter() - started
+    return {'batch_s': elapsed, 'qps': len(queries) / elapsed}
+
+
+def bench_size(rows, engines, args, rng):
+    """Run every engine against one dataset size and return result records"""
+    started = time.perf_counter()
+    features = make_dataset(rows, args.seed)
+    load_s = time.perf_counter() - started
+    print(f"\n{rows:,} rows (loaded in {load_s:.1f}s)")
+
+    single_queries = make_queries(args.queries, rng)
+    batch_queries = make_queries(args.batch, rng)
+    state_names = features.states.tolist()
+    single_states = [state_names[i] for i in rng.integers(len(state_names), size=args.queries)]
+    batch_states = np.array(state_names, dtype=object)[rng.integers(len(state_names), size=args.batch)]
+
+    results = []
+
+    def record(engine, mode, build_s, stats, sampler):
+        # Memory is the engine's own: peak RSS growth since just before its build
+        result = dict(rows=rows, engine=engine, mode=mode, build_s=build_s, peak_rss_delta_mb=sampler.delta_mb,
+                      **stats)
+        results.append(result)
+        qps = f"{result['qps']:,.0f} q/s"
+        latency = f"p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms  " if 'p50_ms' in result else ''
+        print(f"  {engine:<12} {mode:<9} {latency}{qps}  "
+              f"(build {build_s:.2f}s, peak RSS +{result['peak_rss_delta_mb']:.1f} MB)")
+
+    for engine in engines:
+        with RssSampler() as sampler:
+            bench_engine(engine, rows, features, args, single_queries, single_states, batch_queries, batch_states,
+                         lambda *fields: record(*fields, sampler))
+    return results
+
+
+def bench_engine(engine, rows, features, args, single_queries, single_states, batch_queries, batch_states, record):
+    """Build one engine and time its single, batch and cached modes, passing each result to record"""
+    if engine == 'prototype':
+        # Distinct crops from the per-label prototype index (independent of the row engine)
+        started = time.perf_counter()
+        recommender = CropRecommender(features, 'brute')
+        build_s = time.perf_counter() - started
+        record(engine, 'single', build_s, time_single(
+            lambda *query: recommender.recommend(*query, distinct=True), single_queries, single_states))
+        return
+
+    if engine == 'pandas':
+        if rows > args.pandas_max_rows:
+            print(f"  {engine:<12} skipped above {args.pandas_max_rows:,} rows")
+            return
+        started = time.perf_counter()
+        baseline = PandasBaseline(features)
+        build_s = time.perf_counter() - started
+        # The pandas path ignores state and has no batch mode; a short sample is enough
+        count = min(args.queries, 50)
+        record(engine, 'single', build_s, time_single(baseline.recommend, single_queries[:count],
+                                                       single_states[:count]))
+        return
+
+    started = time.perf_counter()
+    if engine == 'ooc':
+        recommender = OutOfCoreRecommender(features)
+    elif engine == 'sharded':
+        recommender = CropRecommender(features, engine, workers=args.workers)
+    else:
+        recommender = CropRecommender(features, engine)
+    build_s = time.perf_counter() - started
+    record(engine, 'single', build_s, time_single(recommender.recommend, single_queries, single_states))
+    record(engine, 'batch', build_s, time_batch(recommender.recommend_batch, batch_queries, batch_states))
+
+    if args.cache:
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source')
+            open(source, 'w').close()
+            cache = RecommendationCache(os.path.join(directory, 'cache.sqlite'), source)
+            # Replay the same queries twice so the second pass is served from the cache
+            repeated = np.concatenate([single_queries, single_queries])
+            stats = time_single(lambda *query: cache.recommend(recommender, *query), repeated,
+                                single_states + single_states)
+            stats['hit_rate'] = cache.stats()['hit_rate']
+            record(f"{engine}+cache", 'single', build_s, stats)
+
+
+def compare(results, baseline_path, tolerance):
+    """Print regressions against an earlier results file and return how many there were"""
+    with open(baseline_path) as f:
+        previous = {(r['rows'], r['engine'], r['mode']): r for r in json.load(f)['results']}
+    regressions = 0
+    print(f"\nComparison with {baseline_path} (tolerance {tolerance:.0%})")
+    for result in results:
+        before = previous.get((result['rows'], result['engine'], result['mode']))
+        if before is None:
+            continue
+        change = result['qps'] / before['qps'] - 1
+        flag = 'REGRESSION' if change < -tolerance else 'ok'
+        regressions += flag != 'ok'
+        print(f"  {result['rows']:>10,} {result['engine']:<16} {result['mode']:<7} "
+              f"{before['qps']:>12,.0f} -> {result['qps']:>12,.0f} q/s ({change:+.1%}) {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma-separated dataset sizes in rows')
+    parser.add_argument('--engines', default=','.join(['pandas', *ENGINES, 'prototype', 'ooc']),
+                        help='comma-separated engines: pandas (original path), crop_engine.ENGINES names, '
+                             'prototype (distinct crops) or ooc (out-of-core scan)')
+    parser.add_argument('--queries', type=int, default=500, help='single queries per engine')
+    parser.add_argument('--batch', type=int, default=100000, help='rows per batch query')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='skip the cached runs')
+    parser.add_argument('--pandas-max-rows', type=int, default=PANDAS_MAX_ROWS)
+    parser.add_argument('--workers', type=int, help='threads for the sharded engine (default: CPU count)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fractional q/s drop')
+    args = parser.parse_args()
+
+    engines = [e for e in args.engines.split(',') if e]
+    unknown = [e for e in engines if e not in ('pandas', 'prototype', 'ooc') and e not in ENGINES]
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(unknown)}")
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for rows in [int(s) for s in args.sizes.split(',') if s]:
+        results.extend(bench_size(rows, engines, args, rng))
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
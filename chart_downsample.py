@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Point-budget downsampling for chart series
+
+Largest-Triangle-Three-Buckets keeps the visual shape of a line in a fixed
+number of points; min/max bucketing keeps every spike. Downsampled frames
+are cached per (series, resolution) so reruns do not ship or recompute
+full histories.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_POINTS = 500
+METHODS = ('lttb', 'minmax')
+
+
+def _as_numbers(x):
+    """Float positions for an index (datetimes become nanoseconds)"""
+    if isinstance(x, pd.DatetimeIndex) or np.issubdtype(np.asarray(x).dtype, np.datetime64):
+        return np.asarray(x, dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+    return np.asarray(x, dtype=np.float64)
+
+
+def lttb(x, y, threshold):
+    """Indices of the threshold points chosen by Largest-Triangle-Three-Buckets
+
+    The first and last points are always kept; NaNs in y are treated as
+    missing and never chosen.
+    """
+    x, y = _as_numbers(x), np.asarray(y, dtype=np.float64)
+    finite = np.flatnonzero(np.isfinite(y))
+    n = len(finite)
+    if threshold >= n:
+        return finite
+    if threshold < 3:
+        return finite[[0, n - 1]][:max(threshold, 0)]
+    x, y = x[finite], y[finite]
+
+    # Bucket edges over the interior points, as in the reference algorithm
+    every = (n - 2) / (threshold - 2)
+    edges = (np.floor(np.arange(threshold - 1) * every) + 1).astype(np.intp)
+    chosen = np.empty(threshold, dtype=np.intp)
+    chosen[0], chosen[-1] = 0, n - 1
+    previous = 0
+    for b in range(threshold - 2):
+        start, stop = edges[b], edges[b + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex
+        next_stop = edges[b + 2] if b + 2 < len(edges) else n
+        next_start = stop
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+        areas = np.abs((x[previous] - avg_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        chosen[b + 1] = previous
+    return finite[chosen]
+
+
+def minmax(y, buckets):
+    """Indices of the minimum and maximum of each of buckets equal-width runs, in order
+
+    The first and last points are always kept as well, so at most
+    2 * buckets + 2 indices are returned.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.flatnonzero(np.isfinite(y))
+    if 2 * buckets + 2 >= len(finite):
+        return finite
+    values = y[finite]
+    starts = np.floor(np.linspace(0, len(finite), buckets + 1)[:-1]).astype(np.intp)
+    lows = np.minimum.reduceat(values, starts)
+    highs = np.maximum.reduceat(values, starts)
+    bucket = np.repeat(np.arange(buckets), np.diff(np.append(starts, len(finite))))
+    # First position in each bucket holding its min and its max
+    is_low = values == lows[bucket]
+    is_high = values == highs[bucket]
+    low_at = np.full(buckets, len(values))
+    high_at = np.full(buckets, len(values))
+    np.minimum.at(low_at, bucket[is_low], np.flatnonzero(is_low))
+    np.minimum.at(high_at, bucket[is_high], np.flatnonzero(is_high))
+    picked = np.unique(np.concatenate([low_at, high_at, [0, len(values) - 1]]))
+    return finite[picked]
+
+
+def downsample(frame, points=DEFAULT_POINTS, method='lttb'):
+    """Rows of a series or frame that keep its shape in at most points rows
+
+    With several columns the first one chooses the rows for LTTB, so bands
+    such as forecast/lower/upper stay aligned; min/max keeps the extremes
+    of every column, falling back to LTTB when the budget is too small for
+    one bucket and both endpoints per column.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}', choose from {', '.join(METHODS)}")
+    if len(frame) <= points:
+        return frame
+    columns = frame.to_frame() if isinstance(frame, pd.Series) else frame
+    # Each column keeps two points per bucket plus its own two endpoints
+    per_column = (points // columns.shape[1] - 2) // 2
+    if method == 'lttb' or per_column < 1:
+        rows = lttb(columns.index, columns.iloc[:, 0].to_numpy(), points)
+    else:
+        rows = np.unique(np.concatenate([minmax(columns[column].to_numpy(), per_column)
+                                         for column in columns.columns]))
+    return frame.iloc[rows]
+
+
+class DownsampleCache:
+    """Thread-safe LRU of downsampled series keyed by (series key, points, method)
+
+    Include a data version in the series key so new data is not served stale.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load, points=DEFAULT_POINTS, method='lttb'):
+        """Downsampled load() for key, computing it only on a miss"""
+        cache_key = (key, points, method)
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return self._entries[cache_key]
+            self.misses += 1
+        value = downsample(load(), points, method)
+        with self._lock:
+            self._entries[cache_key] = value
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
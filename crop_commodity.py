@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Join from crop recommendation labels to Agmarknet commodities
+
+The crop dataset says "rice" and "chickpea" where mandis report
+"Paddy(Dhan)(Common)" and "Bengal Gram(Gram)(Whole)". The label to
+commodity table is built once from a bundled alias list plus normalized
+name matching, and a price matrix of current modal price per (state,
+label) is precomputed from it, so revenue-ranking a recommendation is a
+dict lookup and a few array operations with no string matching. State
+names are matched through an alias table, since the crop data and the price
+data spell some states differently ("Orissa" and "Odisha").
+
+    python crop_commodity.py --state Kerala
+"""
+
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+ALIASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crop_commodity_aliases.csv')
+PRICE_COLUMN = 'Modal_x0020_Price'
+# Price row used for states without their own mandi prices
+ALL_STATES = 'All states'
+DEFAULT_CANDIDATES = 10
+
+MAPPING_COLUMNS = ['label', 'commodity', 'priority', 'source']
+
+# Normalized state spellings found in crop and Agmarknet data, to one normalized name
+STATE_ALIASES = {
+    'orissa': 'odisha',
+    'uttrakhand': 'uttarakhand',
+    'uttaranchal': 'uttarakhand',
+    'chattisgarh': 'chhattisgarh',
+    'chhatisgarh': 'chhattisgarh',
+    'telengana': 'telangana',
+    'pondicherry': 'puducherry',
+    'nct of delhi': 'delhi',
+    'new delhi': 'delhi',
+    'jammu kashmir': 'jammu and kashmir',
+    'andaman nicobar': 'andaman and nicobar islands',
+    'andaman and nicobar': 'andaman and nicobar islands',
+}
+
+
+def normalize_name(name):
+    """Lower-case name with every run of non-alphanumerics collapsed to one space"""
+    return re.sub(r'[^a-z0-9]+', ' ', str(name).lower()).strip()
+
+
+def normalize_state(name):
+    """Normalized state name with alternative spellings mapped to one form"""
+    key = normalize_name(name)
+    return STATE_ALIASES.get(key, key)
+
+
+def load_aliases(path=ALIASES_PATH):
+    """Label to commodity aliases in priority order, or an empty table (with a warning) if unreadable"""
+    try:
+        return pd.read_csv(path, dtype=str)
+    except FileNotFoundError:
+        print(f"Crop commodity alias error: {path} not found, matching labels by name only")
+        return pd.DataFrame(columns=['label', 'commodity'])
+    except (OSError, ValueError) as e:
+        print(f"Crop commodity alias error: {e}")
+        return pd.DataFrame(columns=['label', 'commodity'])
+
+
+def build_commodity_map(labels, commodities, aliases=None):
+    """Label to commodity table, best match first for every label
+
+    Labels listed in the aliases use exactly those commodities, in the
+    listed order. Other labels take commodities whose normalized name
+    equals theirs or, failing that, contains the label (or its singular)
+    as a word.
+    """
+    aliases = load_aliases() if aliases is None else aliases
+    commodities = list(commodities)
+    by_name = {}
+    for commodity in commodities:
+        by_name.setdefault(normalize_name(commodity), []).append(commodity)
+    words = [(commodity, set(normalize_name(commodity).split())) for commodity in commodities]
+
+    records = []
+    aliased = aliases.groupby('label', sort=False)['commodity'].agg(list).to_dict()
+    for label in labels:
+        if label in aliased:
+            matches, source = aliased[label], 'alias'
+        else:
+            key = normalize_name(label)
+            matches, source = by_name.get(key, []), 'name'
+            if not matches:
+                forms = {key, key[:-1]} if key.endswith('s') else {key}
+                matches = [commodity for commodity, tokens in words if forms & tokens]
+                source = 'word'
+        records.extend((label, commodity, priority, source) for priority, commodity in enumerate(matches))
+    return pd.DataFrame(records, columns=MAPPING_COLUMNS)
+
+
+def current_prices(frame):
+    """Median modal price per (State, Commodity) on the latest date each pair was reported
+
+    Returns (state prices, all-state prices), the latter per Commodity.
+    """
+    columns = ['State', 'Commodity', 'Arrival_Date', PRICE_COLUMN]
+    frame = frame[columns]
+    latest = frame.groupby(['State', 'Commodity'], observed=True)['Arrival_Date'].transform('max')
+    recent = frame[frame['Arrival_Date'] == latest]
+    by_state = recent.groupby(['State', 'Commodity'], observed=True)[PRICE_COLUMN].median()
+    national_latest = frame.groupby('Commodity', observed=True)['Arrival_Date'].transform('max')
+    national = frame[frame['Arrival_Date'] == national_latest].groupby('Commodity', observed=True)[PRICE_COLUMN].median()
+    return by_state, national
+
+
+class RevenueScorer:
+    """Current modal price per (state, crop label) from the best-ranked commodity each state reports
+
+    prices[s, l] is the price for label l in state row s; the last row is the
+    all-states fallback, which also fills labels a state has no mandi price for.
+    """
+
+    def __init__(self, labels, price_frame, aliases=None):
+        self.labels = list(labels)
+        self.label_codes = {label: code for code, label in enumerate(self.labels)}
+        commodities = price_frame['Commodity'].astype('category').cat.categories
+        self.mapping = build_commodity_map(self.labels, commodities, aliases)
+        by_state, national = current_prices(price_frame)
+
+        self.states = sorted(by_state.index.get_level_values('State').unique())
+        self.state_rows = {normalize_state(state): row for row, state in enumerate(self.states)}
+        self.national_row = len(self.states)
+        shape = (len(self.states) + 1, len(self.labels))
+        self.prices = np.full(shape, np.nan)
+        self.commodity_codes = np.full(shape, -1, dtype=np.int32)
+        self.commodities = pd.Index(self.mapping['commodity'].unique())
+
+        # Fill from the lowest priority up, so the best-ranked commodity a state reports wins
+        state_table = by_state.unstack('State').reindex(columns=self.states)
+        for priority in sorted(self.mapping['priority'].unique(), reverse=True):
+            level = self.mapping[self.mapping['priority'] == priority]
+            present = level[level['commodity'].isin(state_table.index)]
+            label_cols = present['label'].map(self.label_codes).to_numpy()
+            commodity_codes = self.commodities.get_indexer(present['commodity'])
+            values = state_table.reindex(present['commodity']).to_numpy().T
+            found = np.isfinite(values)
+            rows, cols = np.nonzero(found)
+            self.prices[rows, label_cols[cols]] = values[rows, cols]
+            self.commodity_codes[rows, label_cols[cols]] = commodity_codes[cols]
+            national_values = national.reindex(present['commodity']).to_numpy()
+            known = np.isfinite(national_values)
+            self.prices[self.national_row, label_cols[known]] = national_values[known]
+            self.commodity_codes[self.national_row, label_cols[known]] = commodity_codes[known]
+
+        self.local = np.isfinite(self.prices)
+        missing = ~self.local[:-1]
+        self.prices[:-1][missing] = np.broadcast_to(self.prices[-1], missing.shape)[missing]
+        self.commodity_codes[:-1][missing] = np.broadcast_to(self.commodity_codes[-1], missing.shape)[missing]
+
+    def state_row(self, state):
+        """Price row for a state name (any spelling in STATE_ALIASES), the all-states row when it has no prices"""
+        return self.state_rows.get(normalize_state(state), self.national_row) if state else self.national_row
+
+    @property
+    def priced_labels(self):
+        return int(np.isfinite(self.prices[self.national_row]).sum())
+
+    def rank(self, crops, confidences, state=None):
+        """Crops ordered by expected price (confidence x current modal price), unpriced crops last
+
+        Returns a DataFrame with crop, confidence, commodity, modal_price,
+        expected_price and price_scope (the state, or "All states").
+        """
+        codes = np.array([self.label_codes.get(crop, -1) for crop in crops], dtype=np.intp)
+        confidences = np.asarray(confidences, dtype=np.float64)
+        row = self.state_row(state)
+        known = codes >= 0
+        prices = np.where(known, self.prices[row, np.maximum(codes, 0)], np.nan)
+        commodity_codes = np.where(known, self.commodity_codes[row, np.maximum(codes, 0)], -1)
+        local = known & self.local[row, np.maximum(codes, 0)] & (row != self.national_row)
+        expected = confidences / 100 * prices
+        # Primary key expected price (NaN sorts last), ties broken by confidence
+        order = np.lexsort((-confidences, np.where(np.isfinite(expected), -expected, np.inf)))
+        commodities = np.append(np.asarray(self.commodities, dtype=object), None)
+        scope = self.states[row] if row < self.national_row else ALL_STATES
+        return pd.DataFrame({
+            'crop': np.asarray(crops, dtype=object)[order],
+            'confidence': confidences[order],
+            'commodity': commodities[commodity_codes[order]],
+            'modal_price': prices[order],
+            'expected_price': expected[order],
+            'price_scope': np.where(local[order], scope, ALL_STATES),
+        })
+
+
+def recommend_by_revenue(recommend, scorer, N, P, K, temperature, humidity, ph, rainfall, state=None, k=3,
+                         candidates=DEFAULT_CANDIDATES):
+    """Top k of the nearest distinct candidate crops re-ranked by expected price
+
+    recommend is called as recommend(N, P, K, ..., state, candidates) and
+    returns (crops, confidences, partition), like CropRecommender.recommend
+    with distinct set. Returns (ranked DataFrame, partition).
+    """
+    crops, confidences, partition = recommend(N, P, K, temperature, humidity, ph, rainfall, state,
+                                              max(k, candidates))[:3]
+    return scorer.rank(crops, confidences, state).head(k).reset_index(drop=True), partition
+
+
+def main():
+    from crop_data import load_crop_features
+    from price_data import PRICE_DATA_PATH, load_price_data
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--crops', default='crop_recommendation.csv', help='crop recommendation CSV')
+    parser.add_argument('--prices', default=PRICE_DATA_PATH, help='Agmarknet price CSV')
+    parser.add_argument('--state', help='show current prices for this state')
+    args = parser.parse_args()
+
+    features = load_crop_features(args.crops)
+    scorer = RevenueScorer(features.labels, load_price_data(args.prices).frame)
+    matched = scorer.mapping['label'].nunique()
+    print(f"{matched} of {len(scorer.labels)} crop labels map to Agmarknet commodities, "
+          f"{scorer.priced_labels} have current prices")
+    print(scorer.mapping.groupby('label', sort=False)['commodity'].agg(', '.join).to_string())
+    ranked = scorer.rank(scorer.labels, np.full(len(scorer.labels), 100.0), args.state)
+    print(ranked.dropna(subset=['modal_price']).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory representation of crop_recommendation.csv
+
+The first load writes a typed binary snapshot next to the CSV
+(crop_recommendation.snapshot/); later loads memory-map it instead of
+parsing the CSV, until the CSV changes.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FEATURE_COLUMNS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+FEATURE_DTYPE = np.float32
+CODE_DTYPE = np.int16
+# State code of rows without a State; they are only in the all-states partition
+NO_STATE = -1
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ARRAYS = ('matrix', 'label_codes', 'state_codes')
+
+
+def _read_only(array):
+    """Mark an array read-only so shared copies cannot be modified in place"""
+    array.flags.writeable = False
+    return array
+
+
+class CropFeatures:
+    """C-contiguous float32 feature matrix with integer label and state codes (NO_STATE for no state)"""
+
+    def __init__(self, matrix, label_codes, labels, state_codes, states):
+        self.matrix = _read_only(np.ascontiguousarray(matrix, dtype=FEATURE_DTYPE))
+        self.label_codes = _read_only(np.ascontiguousarray(label_codes, dtype=CODE_DTYPE))
+        self.labels = _read_only(np.asarray(labels, dtype=object))
+        self.state_codes = _read_only(np.ascontiguousarray(state_codes, dtype=CODE_DTYPE))
+        self.states = _read_only(np.asarray(states, dtype=object))
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the feature matrix and code arrays"""
+        return self.matrix.nbytes + self.label_codes.nbytes + self.state_codes.nbytes
+
+    def label_names(self, indices):
+        """Return crop labels for the given row indices"""
+        return self.labels[self.label_codes[indices]]
+
+    def state_names(self, indices):
+        """Return state names for the given row indices, None for rows without a state"""
+        # NO_STATE (-1) indexes the appended None rather than wrapping to the last state
+        return np.append(self.states, None)[self.state_codes[indices]]
+
+
+def file_fingerprint(path):
+    """Return (size, mtime_ns) identifying the current version of a file"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_crop_features(df_crop):
+    """Build CropFeatures from a crop recommendation DataFrame"""
+    label_codes, labels = pd.factorize(df_crop['label'])
+    state_codes, states = pd.factorize(df_crop['State'], use_na_sentinel=True)
+    matrix = df_crop[FEATURE_COLUMNS].to_numpy(dtype=FEATURE_DTYPE)
+    return CropFeatures(matrix, label_codes, labels, state_codes, states)
+
+
+def file_digest(path, limit=None, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, or of its first limit bytes"""
+    digest = hashlib.sha256()
+    remaining = float('inf') if limit is None else limit
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            chunk = f.read(int(min(chunk_size, remaining)))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_dir(path):
+    """Directory holding the binary snapshot for a CSV file"""
+    return os.path.splitext(path)[0] + '.snapshot'
+
+
+def write_json_atomic(path, data):
+    """Write JSON to path via a temporary file and rename"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def write_crop_snapshot(features, directory, meta):
+    """Write CropFeatures as .npy arrays plus a meta.json describing the source CSV"""
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, 'meta.json')
+    # meta.json is written last and marks the snapshot as complete
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name in SNAPSHOT_ARRAYS:
+        tmp_path = os.path.join(directory, f"{name}.{os.getpid()}.tmp.npy")
+        np.save(tmp_path, getattr(features, name))
+        os.replace(tmp_path, os.path.join(directory, f"{name}.npy"))
+    meta = dict(meta, version=SNAPSHOT_VERSION, rows=len(features),
+                labels=features.labels.tolist(), states=features.states.tolist())
+    write_json_atomic(meta_path, meta)
+
+
+def read_snapshot_meta(directory):
+    """Return the snapshot's meta.json contents, or None if there is no usable snapshot"""
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == SNAPSHOT_VERSION else None
+
+
+def read_crop_snapshot(directory, meta=None):
+    """Memory-map a snapshot written by write_crop_snapshot into CropFeatures"""
+    meta = meta or read_snapshot_meta(directory)
+    arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in SNAPSHOT_ARRAYS}
+    return CropFeatures(arrays['matrix'], arrays['label_codes'], meta['labels'],
+                        arrays['state_codes'], meta['states'])
+
+
+def parse_crop_csv(path):
+    """Parse crop_recommendation.csv into CropFeatures"""
+    dtypes = {column: FEATURE_DTYPE for column in FEATURE_COLUMNS}
+    dtypes.update({'label': 'category', 'State': 'category'})
+    return build_crop_features(pd.read_csv(path, dtype=dtypes))
+
+
+def load_crop_features(path='crop_recommendation.csv', use_snapshot=True):
+    """Load crop_recommendation.csv into CropFeatures, via the binary snapshot when it is current"""
+    if not use_snapshot:
+        return parse_crop_csv(path)
+
+    directory = snapshot_dir(path)
+    size, mtime_ns = file_fingerprint(path)
+    meta = read_snapshot_meta(directory)
+    if meta and meta['size'] == size:
+        try:
+            if meta['mtime_ns'] == mtime_ns:
+                return read_crop_snapshot(directory, meta)
+            # Touched but possibly unchanged: the hash decides
+            if meta['sha256'] == file_digest(path):
+                write_json_atomic(os.path.join(directory, 'meta.json'), dict(meta, mtime_ns=mtime_ns))
+                return read_crop_snapshot(directory, meta)
+        except (OSError, ValueError) as e:
+            print(f"Crop snapshot read error: {e}")
+
+    features = parse_crop_csv(path)
+    try:
+        write_crop_snapshot(features, directory, {'size': size, 'mtime_ns': mtime_ns, 'sha256': file_digest(path)})
+    except OSError as e:
+        print(f"Crop snapshot write error: {e}")
+    return features
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Nearest-neighbour engines for crop recommendation
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from crop_data import FEATURE_COLUMNS, FEATURE_DTYPE
+
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_AVAILABLE = True
+except ImportError:
+    cKDTree = None
+    SCIPY_AVAILABLE = False
+
+# Extra candidates re-ranked exactly after the fast matrix-product pass, so
+# float rounding in the expanded distance cannot push a true neighbour out.
+CANDIDATE_MARGIN = 32
+
+# Upper bound on the (queries x rows) distance block held in memory at once
+BLOCK_BYTES = 64 * 1024 * 1024
+
+# Sharded scans split a matrix into at most one shard per worker, but never
+# into shards smaller than this (thread hand-off costs more than the scan)
+MIN_SHARD_ROWS = 50000
+
+# Queries handed to an engine per pass in batch recommendation
+BATCH_BLOCK_ROWS = 65536
+
+# Medoids kept per crop label for the distinct-crop prototype index
+PROTOTYPE_MEDOIDS = 4
+
+# Rows read from disk per pass in out-of-core mode
+OUT_OF_CORE_BLOCK_ROWS = 1 << 20
+
+
+def _as_queries(points, n_features, dtype=FEATURE_DTYPE):
+    """Return query points as a 2-D array in the feature dtype"""
+    queries = np.asarray(points, dtype=dtype)
+    if queries.ndim == 1:
+        queries = queries.reshape(1, -1)
+    if queries.ndim != 2 or queries.shape[1] != n_features:
+        raise ValueError(f"Expected points with {n_features} features, got shape {queries.shape}")
+    return queries
+
+
+def _nearest_rows(matrix, sq_norms, queries, k):
+    """Exact (distances, indices) of the k nearest rows of matrix, ties broken by row order"""
+    n = len(matrix)
+    depth = min(n, k + CANDIDATE_MARGIN)
+    # Cheap squared distances to pick candidates
+    approx = sq_norms[None, :] - 2 * (queries @ matrix.T)
+    if depth < n:
+        candidates = np.argpartition(approx, depth - 1, axis=1)[:, :depth]
+    else:
+        candidates = np.broadcast_to(np.arange(n), approx.shape)
+    # Exact distances on the candidates
+    diff = matrix[candidates] - queries[:, None, :]
+    exact = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+    order = np.lexsort((candidates, exact), axis=1)[:, :k]
+    return np.take_along_axis(exact, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+
+
+def _merge_nearest(distances, indices, new_distances, new_indices, k):
+    """Merge two (distances, indices) top-k sets, keeping ties in row order"""
+    distances = np.concatenate([distances, new_distances], axis=1)
+    indices = np.concatenate([indices, new_indices], axis=1)
+    order = np.lexsort((indices, distances), axis=1)[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class BruteForceEngine:
+    """Exact nearest-neighbour search by scanning every row"""
+
+    name = 'brute'
+
+    def __init__(self, features):
+        self.features = np.ascontiguousarray(features, dtype=FEATURE_DTYPE)
+        self.sq_norms = np.einsum('ij,ij->i', self.features, self.features)
+
+    def __len__(self):
+        return len(self.features)
+
+    def _block_size(self):
+        itemsize = self.features.dtype.itemsize
+        return max(1, BLOCK_BYTES // (itemsize * max(1, len(self.features))))
+
+    def query(self, points, k=3):
+        """Return (distances, indices) of the k nearest rows for each point"""
+        queries = _as_queries(points, self.features.shape[1])
+        k = min(k, len(self.features))
+        distances = np.empty((len(queries), k), dtype=self.features.dtype)
+        indices = np.empty((len(queries), k), dtype=np.intp)
+
+        step = self._block_size()
+        for start in range(0, len(queries), step):
+            block = slice(start, start + step)
+            distances[block], indices[block] = _nearest_rows(self.features, self.sq_norms, queries[block], k)
+        return distances, indices
+
+
+class KDTreeEngine:
+    """k-d tree over the feature rows, built once and queried many times"""
+
+    name = 'kdtree'
+
+    def __init__(self, features, leafsize=32):
+        if not SCIPY_AVAILABLE:
+            raise ImportError("scipy is required for the kdtree engine")
+        self.features = np.ascontiguousarray(features, dtype=FEATURE_DTYPE)
+        # cKDTree keeps its own float64 copy, made once here rather than per query
+        self.tree = cKDTree(self.features, leafsize=leafsize)
+
+    def __len__(self):
+        return len(self.features)
+
+    def query(self, points, k=3):
+        """Return (distances, indices) of the k nearest rows for each point"""
+        queries = _as_queries(points, self.features.shape[1], np.float64)
+        k = min(k, len(self.features))
+        distances, indices = self.tree.query(queries, k=k)
+        return distances.reshape(len(queries), k), indices.reshape(len(queries), k)
+
+
+def default_workers():
+    """Worker count from CROP_ENGINE_WORKERS, else the number of CPUs"""
+    return int(os.getenv('CROP_ENGINE_WORKERS', 0)) or os.cpu_count() or 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _shard_pool(workers):
+    """Process-wide thread pool shared by every sharded engine with this worker count"""
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crop-shard')
+        return _pools[workers]
+
+
+class ShardedEngine:
+    """Splits the rows into per-core shards scanned concurrently on a thread pool
+
+    Each shard is a contiguous view of the matrix with its own engine; the
+    per-shard top-k sets are merged with ties kept in row order. NumPy
+    releases the GIL in the scan kernels, so shards run in parallel.
+    """
+
+    name = 'sharded'
+
+    def __init__(self, features, workers=None, shard_engine=BruteForceEngine.name):
+        self.features = np.ascontiguousarray(features, dtype=FEATURE_DTYPE)
+        self.workers = workers or default_workers()
+        n_shards = max(1, min(self.workers, len(self.features) // MIN_SHARD_ROWS))
+        bounds = np.linspace(0, len(self.features), n_shards + 1).astype(int)
+        self.offsets = bounds[:-1]
+        self.shards = [ENGINES[shard_engine](self.features[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def __len__(self):
+        return len(self.features)
+
+    def _query_shard(self, shard, offset, queries, k):
+        distances, indices = shard.query(queries, k)
+        return distances.astype(FEATURE_DTYPE, copy=False), indices + offset
+
+    def query(self, points, k=3):
+        """Return (distances, indices) of the k nearest rows for each point"""
+        queries = _as_queries(points, self.features.shape[1])
+        k = min(k, len(self.features))
+        if len(self.shards) == 1:
+            return self._query_shard(self.shards[0], 0, queries, k)
+        pool = _shard_pool(self.workers)
+        futures = [pool.submit(self._query_shard, shard, offset, queries, k)
+                   for shard, offset in zip(self.shards, self.offsets)]
+        distances, indices = futures[0].result()
+        for future in futures[1:]:
+            distances, indices = _merge_nearest(distances, indices, *future.result(), k)
+        return distances, indices
+
+
+ENGINES = {
+    BruteForceEngine.name: BruteForceEngine,
+    KDTreeEngine.name: KDTreeEngine,
+    ShardedEngine.name: ShardedEngine,
+}
+
+
+def build_engine(features, kind='auto', **options):
+    """Build a nearest-neighbour engine by name ('auto' prefers the k-d tree)"""
+    if kind == 'auto':
+        kind = KDTreeEngine.name if SCIPY_AVAILABLE else BruteForceEngine.name
+    if kind not in ENGINES:
+        raise ValueError(f"Unknown engine '{kind}', choose from {sorted(ENGINES)}")
+    return ENGINES[kind](features, **options)
+
+
+# Partition name for queries that are not scoped to a single state
+ALL_STATES = 'All States'
+
+
+def _partition_rows(matrix, rows):
+    """Return the feature rows for a partition, as a view when they are contiguous"""
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        return matrix[rows[0]:rows[-1] + 1]
+    return matrix[rows]
+
+
+def _cluster_medoids(points, n_medoids, iterations=5):
+    """Return (medoid rows, assignment) for a small k-means clustering of points"""
+    n_medoids = min(n_medoids, len(points))
+    # Farthest-point seeding, then a few Lloyd iterations
+    seeds = [0]
+    nearest = ((points - points[0]) ** 2).sum(axis=1)
+    for _ in range(1, n_medoids):
+        seeds.append(int(nearest.argmax()))
+        nearest = np.minimum(nearest, ((points - points[seeds[-1]]) ** 2).sum(axis=1))
+    centers = points[seeds].astype(np.float64)
+    for _ in range(iterations):
+        assignment = ((points[:, None, :] - centers[None]) ** 2).sum(axis=2).argmin(axis=1)
+        for cluster in range(n_medoids):
+            members = points[assignment == cluster]
+            if len(members):
+                centers[cluster] = members.mean(axis=0)
+    # Snap every centre to its closest real row and reassign around the medoids
+    medoids = np.unique(((points[:, None, :] - centers[None]) ** 2).sum(axis=2).argmin(axis=0))
+    assignment = ((points[:, None, :] - points[medoids][None]) ** 2).sum(axis=2).argmin(axis=1)
+    return medoids, assignment
+
+
+class PrototypeIndex:
+    """Per-label centroids and medoids for finding the top-k distinct crops
+
+    Every prototype carries the radius of the rows it covers, so its distance
+    to a query gives a lower bound on the label's nearest-row distance.
+    Labels are then scanned in bound order and the search stops as soon as
+    no unscanned label can beat the current top-k, which usually means
+    scoring a few hundred prototypes and the rows of a handful of labels.
+    """
+
+    def __init__(self, matrix, label_codes, n_medoids=PROTOTYPE_MEDOIDS):
+        self.matrix = matrix
+        self.order = np.argsort(label_codes, kind='stable')
+        codes, starts = np.unique(label_codes[self.order], return_index=True)
+        self.codes = codes
+        self.starts = starts
+        self.ends = np.append(starts[1:], len(self.order))
+
+        prototypes, radii, owners, centroid = [], [], [], []
+        for slot, (start, end) in enumerate(zip(self.starts, self.ends)):
+            points = matrix[self.order[start:end]].astype(np.float64)
+            center = points.mean(axis=0)
+            prototypes.append(center)
+            radii.append(np.sqrt(((points - center) ** 2).sum(axis=1).max()))
+            owners.append(slot)
+            centroid.append(True)
+            medoids, assignment = _cluster_medoids(points, n_medoids)
+            for cluster, row in enumerate(medoids):
+                members = points[assignment == cluster]
+                prototypes.append(points[row])
+                radii.append(np.sqrt(((members - points[row]) ** 2).sum(axis=1).max()))
+                owners.append(slot)
+                centroid.append(False)
+        self.prototypes = np.asarray(prototypes)
+        # Small slack keeps the bounds valid under float32 rounding of the rows
+        self.radii = np.asarray(radii) * (1 + 1e-5) + 1e-3
+        self.owners = np.asarray(owners)
+        self.is_centroid = np.asarray(centroid)
+
+    def __len__(self):
+        return len(self.prototypes)
+
+    def _label_minimum(self, point, slot):
+        """Exact nearest-row distance from point to one label's rows"""
+        diff = self.matrix[self.order[self.starts[slot]:self.ends[slot]]] - point
+        return float(np.sqrt(np.einsum('ij,ij->i', diff, diff).min()))
+
+    def lower_bounds(self, point):
+        """Lower bound on each label's nearest-row distance, from prototypes only"""
+        distances = np.sqrt(((self.prototypes - point) ** 2).sum(axis=1)) - self.radii
+        centroid_bound = np.zeros(len(self.codes))
+        centroid_bound[self.owners[self.is_centroid]] = distances[self.is_centroid]
+        medoid_bound = np.full(len(self.codes), np.inf)
+        np.minimum.at(medoid_bound, self.owners[~self.is_centroid], distances[~self.is_centroid])
+        return np.maximum(np.maximum(centroid_bound, medoid_bound), 0)
+
+    def full_scan(self, point, k=3):
+        """Return (distances, label codes) of the k nearest distinct labels by scanning every row"""
+        point = np.asarray(point, dtype=self.matrix.dtype).ravel()
+        diff = self.matrix[self.order] - point
+        best = np.minimum.reduceat(np.sqrt(np.einsum('ij,ij->i', diff, diff)), self.starts)
+        top = np.lexsort((self.codes, best))[:k]
+        return best[top].astype(np.float64), self.codes[top]
+
+    def query(self, point, k=3, exact=False):
+        """Return (distances, label codes, verified) for the k nearest distinct labels
+
+        verified is None unless exact is set, in which case the result is
+        checked against a full scan and the full-scan answer is returned.
+        """
+        point = np.asarray(point, dtype=self.matrix.dtype).ravel()
+        bounds = self.lower_bounds(point)
+        k = min(k, len(self.codes))
+        found = []
+        for slot in np.argsort(bounds, kind='stable'):
+            if len(found) >= k and bounds[slot] > found[k - 1][0]:
+                break
+            found.append((self._label_minimum(point, slot), self.codes[slot]))
+            found.sort()
+        distances = np.array([d for d, _ in found[:k]])
+        codes = np.array([c for _, c in found[:k]], dtype=self.codes.dtype)
+        if not exact:
+            return distances, codes, None
+        exact_distances, exact_codes = self.full_scan(point, k)
+        return exact_distances, exact_codes, bool(np.array_equal(codes, exact_codes))
+
+
+class CropPartition:
+    """Nearest-neighbour engine over one slice of the crop records"""
+
+    def __init__(self, name, matrix, rows, label_codes, engine='auto', **engine_options):
+        self.name = name
+        self.rows = rows
+        matrix = matrix if rows is None else _partition_rows(matrix, rows)
+        self.engine = build_engine(matrix, engine, **engine_options)
+        self.prototypes = PrototypeIndex(matrix, label_codes if rows is None else label_codes[rows])
+
+    def __len__(self):
+        return len(self.engine)
+
+    def query(self, points, k=3):
+        """Return (distances, indices) with indices into the full feature matrix"""
+        distances, indices = self.engine.query(points, k)
+        if self.rows is not None:
+            indices = self.rows[indices]
+        return distances, indices
+
+
+class CropRecommender:
+    """Crop recommender with one engine per state plus an all-states fallback"""
+
+    def __init__(self, features, engine='auto', **engine_options):
+        self.features = features
+        self.states = features.states.tolist()
+        self.partitions = {ALL_STATES: CropPartition(ALL_STATES, features.matrix, None, features.label_codes,
+                                                     engine, **engine_options)}
+        for code, state in enumerate(self.states):
+            rows = np.flatnonzero(features.state_codes == code)
+            self.partitions[state] = CropPartition(state, features.matrix, rows, features.label_codes,
+                                                   engine, **engine_options)
+
+    def partition_for(self, state):
+        """Return the partition serving a state, falling back to all states"""
+        return self.partitions.get(state, self.partitions[ALL_STATES])
+
+    def _query_matrix(self, conditions):
+        """Return batch conditions as an (m x 7) array in the feature dtype"""
+        if isinstance(conditions, pd.DataFrame):
+            conditions = conditions[FEATURE_COLUMNS].to_numpy()
+        return _as_queries(conditions, len(FEATURE_COLUMNS))
+
+    def _state_groups(self, states, m):
+        """Yield (query rows, state) pairs, one per distinct requested state"""
+        if states is None or np.ndim(states) == 0:
+            yield np.arange(m), states
+            return
+        if len(states) != m:
+            raise ValueError(f"Expected {m} states, got {len(states)}")
+        state_codes, unique_states = pd.factorize(pd.Series(states, dtype=object), use_na_sentinel=True)
+        missing = np.flatnonzero(state_codes == -1)
+        if len(missing):
+            yield missing, None
+        for code, state in enumerate(unique_states):
+            yield np.flatnonzero(state_codes == code), state
+
+    def query_batch(self, conditions, states=None, k=3, block_rows=BATCH_BLOCK_ROWS):
+        """Return (distances, indices, partition names) for every row of conditions
+
+        states may be a single state, one state per row, or None for all states.
+        A DataFrame with a 'State' column supplies per-row states itself.
+        """
+        if states is None and isinstance(conditions, pd.DataFrame) and 'State' in conditions:
+            states = conditions['State'].to_numpy()
+        queries = self._query_matrix(conditions)
+        m = len(queries)
+        k = min(k, len(self.features))
+        distances = np.empty((m, k), dtype=np.float64)
+        indices = np.empty((m, k), dtype=np.intp)
+        partition_names = np.empty(m, dtype=object)
+
+        for rows, state in self._state_groups(states, m):
+            partition = self.partition_for(state)
+            partition_names[rows] = partition.name
+            # Fixed-size query blocks keep temporary memory bounded for any m
+            for start in range(0, len(rows), block_rows):
+                block = rows[start:start + block_rows]
+                distances[block], indices[block] = partition.query(queries[block], k)
+        return distances, indices, partition_names
+
+    def recommend_batch(self, conditions, states=None, k=3, block_rows=BATCH_BLOCK_ROWS):
+        """Return the k nearest crops for every row of conditions as a tidy DataFrame"""
+        distances, indices, partition_names = self.query_batch(conditions, states, k, block_rows)
+        m, k = distances.shape
+        return pd.DataFrame({
+            'query': np.repeat(np.arange(m), k),
+            'rank': np.tile(np.arange(1, k + 1), m),
+            'label': self.features.label_names(indices.ravel()),
+            'distance': distances.ravel(),
+            'confidence': np.clip(100 - distances.ravel() / 10, 0, 100),
+            'partition': np.repeat(partition_names, k),
+            'row': indices.ravel(),
+        })
+
+    def recommend_distinct(self, N, P, K, temperature, humidity, ph, rainfall, state=None, k=3, exact=False):
+        """Return the k nearest distinct crops, confidences, partition and verification flag"""
+        partition = self.partition_for(state)
+        distances, codes, verified = partition.prototypes.query(
+            [N, P, K, temperature, humidity, ph, rainfall], k, exact)
+        recommended_crops = self.features.labels[codes].tolist()
+        confidences = np.clip(100 - distances / 10, 0, 100).tolist()
+        return recommended_crops, confidences, partition.name, verified
+
+    def recommend(self, N, P, K, temperature, humidity, ph, rainfall, state=None, k=3, distinct=False):
+        """Return crop labels, confidences and the partition that served the query
+
+        With distinct set, each returned crop is a different label.
+        """
+        if distinct:
+            return self.recommend_distinct(N, P, K, temperature, humidity, ph, rainfall, state, k)[:3]
+        distances, indices, partition_names = self.query_batch(
+            [[N, P, K, temperature, humidity, ph, rainfall]], state, k)
+        recommended_crops = self.features.label_names(indices[0]).tolist()
+        confidences = np.clip(100 - distances[0] / 10, 0, 100).tolist()
+        return recommended_crops, confidences, partition_names[0]
+
+
+class OutOfCorePartition:
+    """Streaming nearest-neighbour scan over one state's rows of an on-disk matrix
+
+    Rows are read in fixed-size blocks and a running top-k is kept per query,
+    so memory depends on block_rows and the number of queries, never on the
+    size of the dataset.
+    """
+
+    def __init__(self, name, features, state_code=None, block_rows=OUT_OF_CORE_BLOCK_ROWS):
+        self.name = name
+        self.features = features
+        self.state_code = state_code
+        self.block_rows = block_rows
+
+    def __len__(self):
+        if self.state_code is None:
+            return len(self.features)
+        return int(sum(np.count_nonzero(self.features.state_codes[start:start + self.block_rows] == self.state_code)
+                       for start in range(0, len(self.features), self.block_rows)))
+
+    def blocks(self):
+        """Yield (rows, global row indices) for each block of this partition"""
+        matrix = self.features.matrix
+        for start in range(0, len(matrix), self.block_rows):
+            rows = np.asarray(matrix[start:start + self.block_rows])
+            indices = np.arange(start, start + len(rows))
+            if self.state_code is not None:
+                mask = np.asarray(self.features.state_codes[start:start + len(rows)]) == self.state_code
+                rows, indices = rows[mask], indices[mask]
+            if len(rows):
+                yield rows, indices
+
+    def query(self, points, k=3):
+        """Return (distances, indices) with indices into the full feature matrix"""
+        queries = _as_queries(points, self.features.matrix.shape[1])
+        k = min(k, len(self.features))
+        distances = np.full((len(queries), 0), np.inf, dtype=FEATURE_DTYPE)
+        indices = np.empty((len(queries), 0), dtype=np.intp)
+        step = max(1, BLOCK_BYTES // (self.features.matrix.dtype.itemsize * self.block_rows))
+        for rows, row_indices in self.blocks():
+            sq_norms = np.einsum('ij,ij->i', rows, rows)
+            block_distances, block_indices = [], []
+            for start in range(0, len(queries), step):
+                d, i = _nearest_rows(rows, sq_norms, queries[start:start + step], min(k, len(rows)))
+                block_distances.append(d)
+                block_indices.append(row_indices[i])
+            distances, indices = _merge_nearest(distances, indices, np.vstack(block_distances),
+                                                np.vstack(block_indices), k)
+        return distances, indices
+
+    def distinct(self, point, k=3):
+        """Return (distances, label codes) of the k nearest distinct labels"""
+        point = np.asarray(point, dtype=self.features.matrix.dtype).ravel()
+        best = np.full(len(self.features.labels), np.inf, dtype=self.features.matrix.dtype)
+        for rows, row_indices in self.blocks():
+            diff = rows - point
+            np.minimum.at(best, self.features.label_codes[row_indices],
+                          np.sqrt(np.einsum('ij,ij->i', diff, diff)))
+        codes = np.arange(len(best))
+        top = np.lexsort((codes, best))[:k]
+        top = top[np.isfinite(best[top])]
+        return best[top].astype(np.float64), codes[top]
+
+
+class OutOfCoreRecommender(CropRecommender):
+    """CropRecommender that streams a memory-mapped dataset instead of indexing it
+
+    Use with crop_data.read_crop_snapshot (or load_crop_features) so the
+    feature matrix stays on disk; results match the in-memory brute engine.
+    """
+
+    def __init__(self, features, block_rows=OUT_OF_CORE_BLOCK_ROWS):
+        self.features = features
+        self.states = features.states.tolist()
+        self.partitions = {ALL_STATES: OutOfCorePartition(ALL_STATES, features, None, block_rows)}
+        for code, state in enumerate(self.states):
+            self.partitions[state] = OutOfCorePartition(state, features, code, block_rows)
+
+    def recommend_distinct(self, N, P, K, temperature, humidity, ph, rainfall, state=None, k=3, exact=False):
+        """Return the k nearest distinct crops; the streaming scan is always exact"""
+        partition = self.partition_for(state)
+        distances, codes = partition.distinct([N, P, K, temperature, humidity, ph, rainfall], k)
+        recommended_crops = self.features.labels[codes].tolist()
+        confidences = np.clip(100 - distances / 10, 0, 100).tolist()
+        return recommended_crops, confidences, partition.name, True if exact else None
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Synthetic expansion of crop_recommendation.csv for scale testing
+
+Fits a multivariate normal per (label, State) group of the bundled CSV and
+streams any number of realistic rows in fixed-size chunks, so memory stays
+constant whatever the output size. Output is CSV or the binary snapshot
+format read by crop_data.read_crop_snapshot.
+
+    python expand_crop_dataset.py --rows 5000000 --output crop_large.csv
+    python expand_crop_dataset.py --rows 5000000 --output crop_large.snapshot --format snapshot
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from crop_data import CODE_DTYPE, FEATURE_COLUMNS, FEATURE_DTYPE, NO_STATE, SNAPSHOT_VERSION, write_json_atomic
+
+# Columns drawn as whole numbers, as in the source CSV
+INTEGER_COLUMNS = ['N', 'P', 'K']
+DEFAULT_CHUNK_ROWS = 250000
+
+
+class GroupModel:
+    """Per-(label, State) feature distributions fitted from the crop CSV
+
+    Rows without a State form their own group per label and are generated
+    with the NO_STATE code, so every label keeps its share of the rows.
+    """
+
+    def __init__(self, df_crop):
+        groups = [(key, group[FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+                  for key, group in df_crop.groupby(['label', 'State'], sort=True, observed=True, dropna=False)]
+        keys = [key for key, _ in groups]
+        self.labels = sorted({label for label, _ in keys})
+        self.states = sorted({state for _, state in keys if pd.notna(state)})
+        self.group_label = np.array([self.labels.index(label) for label, _ in keys], dtype=CODE_DTYPE)
+        self.group_state = np.array([self.states.index(state) if pd.notna(state) else NO_STATE for _, state in keys],
+                                    dtype=CODE_DTYPE)
+
+        n_features = len(FEATURE_COLUMNS)
+        self.means = np.empty((len(keys), n_features))
+        self.factors = np.zeros((len(keys), n_features, n_features))
+        self.lower = np.empty((len(keys), n_features))
+        self.upper = np.empty((len(keys), n_features))
+        counts = np.empty(len(keys))
+        for i, (_, values) in enumerate(groups):
+            counts[i] = len(values)
+            self.means[i] = values.mean(axis=0)
+            self.lower[i] = values.min(axis=0)
+            self.upper[i] = values.max(axis=0)
+            if len(values) > 1:
+                # Symmetric square root of the covariance; tolerates singular groups
+                eigenvalues, eigenvectors = np.linalg.eigh(np.cov(values, rowvar=False))
+                self.factors[i] = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+        self.weights = counts / counts.sum()
+
+    def sample(self, rows, rng):
+        """Return (features, label codes, state codes) for rows synthetic records"""
+        groups = rng.choice(len(self.weights), size=rows, p=self.weights)
+        noise = rng.standard_normal((rows, len(FEATURE_COLUMNS)))
+        features = self.means[groups] + np.einsum('nij,nj->ni', self.factors[groups], noise)
+        features = np.clip(features, self.lower[groups], self.upper[groups])
+        for column in INTEGER_COLUMNS:
+            j = FEATURE_COLUMNS.index(column)
+            features[:, j] = np.round(features[:, j])
+        return features.astype(FEATURE_DTYPE), self.group_label[groups], self.group_state[groups]
+
+
+def generate_chunks(model, rows, chunk_rows=DEFAULT_CHUNK_ROWS, seed=42):
+    """Yield (features, label codes, state codes) chunks totalling rows records
+
+    Output depends only on seed, rows and chunk_rows.
+    """
+    children = np.random.SeedSequence(seed).spawn((rows + chunk_rows - 1) // chunk_rows)
+    for i, child in enumerate(children):
+        yield model.sample(min(chunk_rows, rows - i * chunk_rows), np.random.default_rng(child))
+
+
+def write_csv(model, chunks, output):
+    """Stream chunks to a CSV with the same columns as crop_recommendation.csv"""
+    labels = np.asarray(model.labels, dtype=object)
+    # NO_STATE (-1) picks the trailing None, written as an empty State
+    states = np.asarray([*model.states, None], dtype=object)
+    with open(output, 'w', newline='') as f:
+        for i, (features, label_codes, state_codes) in enumerate(chunks):
+            chunk = pd.DataFrame(features, columns=FEATURE_COLUMNS)
+            chunk[INTEGER_COLUMNS] = chunk[INTEGER_COLUMNS].astype(np.int32)
+            chunk['label'] = labels[label_codes]
+            chunk['State'] = states[state_codes]
+            chunk.to_csv(f, header=(i == 0), index=False)
+
+
+def _open_npy(path, dtype, shape):
+    """Open a .npy file for streaming writes, with its header already in place"""
+    f = open(path, 'wb')
+    np.lib.format.write_array_header_2_0(f, {
+        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+        'fortran_order': False,
+        'shape': shape,
+    })
+    return f
+
+
+def write_snapshot(model, chunks, rows, output, meta):
+    """Stream chunks into .npy files in the crop snapshot layout"""
+    os.makedirs(output, exist_ok=True)
+    layout = [
+        ('matrix', FEATURE_DTYPE, (rows, len(FEATURE_COLUMNS))),
+        ('label_codes', CODE_DTYPE, (rows,)),
+        ('state_codes', CODE_DTYPE, (rows,)),
+    ]
+    files = [_open_npy(os.path.join(output, f"{name}.npy"), dtype, shape) for name, dtype, shape in layout]
+    try:
+        for chunk in chunks:
+            for f, (_, dtype, _), array in zip(files, layout, chunk):
+                np.ascontiguousarray(array, dtype=dtype).tofile(f)
+    finally:
+        for f in files:
+            f.close()
+    write_json_atomic(os.path.join(output, 'meta.json'), dict(
+        meta, version=SNAPSHOT_VERSION, rows=rows, labels=model.labels, states=model.states))
+
+
+def expand_dataset(source, output, rows, fmt='csv', chunk_rows=DEFAULT_CHUNK_ROWS, seed=42):
+    """Fit distributions on source and write rows synthetic records to output"""
+    model = GroupModel(pd.read_csv(source))
+    chunks = generate_chunks(model, rows, chunk_rows, seed)
+    if fmt == 'csv':
+        write_csv(model, chunks, output)
+    elif fmt == 'snapshot':
+        write_snapshot(model, chunks, rows, output, {'source': source, 'seed': seed, 'chunk_rows': chunk_rows})
+    else:
+        raise ValueError(f"Unknown format '{fmt}', choose 'csv' or 'snapshot'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--source', default='crop_recommendation.csv', help='CSV to fit distributions on')
+    parser.add_argument('--output', required=True, help='output CSV file or snapshot directory')
+    parser.add_argument('--rows', type=int, required=True, help='number of rows to generate')
+    parser.add_argument('--format', choices=['csv', 'snapshot'], default='csv')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    expand_dataset(args.source, args.output, args.rows, args.format, args.chunk_rows, args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {args.rows:,} rows to {args.output} in {elapsed:.1f}s ({args.rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Nearest-mandi lookup for a farmer's location
+
+Every market in the price data is placed from the bundled coordinate table
+(its own row when there is one, otherwise its district headquarters) and
+projected onto the unit sphere, where straight-line distance orders points
+exactly as great-circle distance does. One k-d tree per commodity over the
+markets that report it answers "k nearest mandis selling X, with their
+latest modal prices" without scanning the price frame.
+
+    python mandi_locations.py --near 30.90 75.86 --commodity Potato
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_AVAILABLE = True
+except ImportError:
+    cKDTree = None
+    SCIPY_AVAILABLE = False
+
+COORDINATES_PATH = 'mandi_coordinates.csv'
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_NEAREST = 5
+LOCATION_COLUMNS = ['State', 'District', 'Market']
+PRICE_COLUMNS = ['Min_x0020_Price', 'Max_x0020_Price', 'Modal_x0020_Price']
+RESULT_COLUMNS = [*LOCATION_COLUMNS, 'distance_km', 'Commodity', 'Arrival_Date', *PRICE_COLUMNS]
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """(n x 3) points on the unit sphere for degrees of latitude and longitude"""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    """Great-circle kilometres for straight-line distances between unit vectors"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def load_coordinates(path=COORDINATES_PATH):
+    """District rows (blank Market) and market rows of the coordinate table"""
+    try:
+        return pd.read_csv(path, dtype={'State': str, 'District': str, 'Market': str}, keep_default_na=False)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=[*LOCATION_COLUMNS, 'Latitude', 'Longitude'])
+
+
+class PointSet:
+    """Nearest unit vectors to a query point, by k-d tree or by a dot-product scan without scipy"""
+
+    def __init__(self, points):
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
+        self.tree = cKDTree(self.points) if SCIPY_AVAILABLE and len(self.points) else None
+
+    def __len__(self):
+        return len(self.points)
+
+    def query(self, point, k):
+        """(chord distances, row positions) of the k nearest points, nearest first"""
+        k = min(k, len(self.points))
+        if k == 0:
+            return np.empty(0), np.empty(0, dtype=np.intp)
+        if self.tree is not None:
+            distances, rows = self.tree.query(point, k=k)
+            return np.atleast_1d(distances), np.atleast_1d(rows)
+        chords = np.sqrt(np.maximum(2 - 2 * (self.points @ point), 0))
+        rows = np.argpartition(chords, k - 1)[:k] if k < len(chords) else np.arange(len(chords))
+        rows = rows[np.argsort(chords[rows], kind='stable')]
+        return chords[rows], rows
+
+
+class MandiIndex:
+    """Located markets of a price frame with their latest prices per commodity
+
+    markets has one row per (State, District, Market) with Latitude,
+    Longitude and located_by ('market' or 'district'); markets in districts
+    the coordinate table does not list are left out and counted in unlocated.
+    """
+
+    def __init__(self, price_frame, coordinates=None):
+        coordinates = load_coordinates() if coordinates is None else coordinates
+        frame = price_frame[[*LOCATION_COLUMNS, 'Commodity', 'Arrival_Date', *PRICE_COLUMNS]]
+        frame = frame.astype({column: str for column in [*LOCATION_COLUMNS, 'Commodity']})
+
+        markets = frame[LOCATION_COLUMNS].drop_duplicates().reset_index(drop=True)
+        is_market = coordinates['Market'] != ''
+        by_market = coordinates[is_market].drop_duplicates(LOCATION_COLUMNS)
+        by_district = coordinates[~is_market].drop(columns='Market').drop_duplicates(LOCATION_COLUMNS[:2])
+        markets = markets.merge(by_market, on=LOCATION_COLUMNS, how='left').merge(
+            by_district, on=LOCATION_COLUMNS[:2], how='left', suffixes=('', '_district'))
+        markets['located_by'] = np.where(markets['Latitude'].notna(), 'market', 'district')
+        for column in ['Latitude', 'Longitude']:
+            markets[column] = markets[column].fillna(markets.pop(f"{column}_district"))
+        located = markets['Latitude'].notna()
+        self.unlocated = int((~located).sum())
+        self.coordinates = coordinates.set_index(LOCATION_COLUMNS)[['Latitude', 'Longitude']]
+        self.markets = markets[located].reset_index(drop=True)
+        self.all_markets = PointSet(to_unit_vectors(self.markets['Latitude'], self.markets['Longitude']))
+
+        # Latest report per (market, commodity): median modal price on its last arrival date
+        market_ids = self.markets.reset_index().set_index(LOCATION_COLUMNS)['index']
+        frame = frame.join(market_ids.rename('market_id'), on=LOCATION_COLUMNS, how='inner')
+        last = frame.groupby(['market_id', 'Commodity'])['Arrival_Date'].transform('max')
+        latest = frame[frame['Arrival_Date'] == last].groupby(['market_id', 'Commodity', 'Arrival_Date']).agg(
+            {'Min_x0020_Price': 'min', 'Max_x0020_Price': 'max', 'Modal_x0020_Price': 'median'})
+        self.latest = latest.reset_index()
+        self.by_commodity = {}
+        for commodity, rows in self.latest.groupby('Commodity').indices.items():
+            ids = self.latest['market_id'].to_numpy()[rows]
+            self.by_commodity[commodity] = (rows, PointSet(self.all_markets.points[ids]))
+
+    def __len__(self):
+        return len(self.markets)
+
+    def describe(self):
+        by_market = int((self.markets['located_by'] == 'market').sum())
+        return (f"{len(self.markets):,} mandis located ({by_market:,} by market, "
+                f"{len(self.markets) - by_market:,} by district), {self.unlocated:,} without coordinates")
+
+    def locate(self, state, district, market=''):
+        """(latitude, longitude) of a market, or of its district headquarters; None if neither is listed"""
+        for key in ((state, district, market), (state, district, '')):
+            if key in self.coordinates.index:
+                row = self.coordinates.loc[key]
+                return float(row['Latitude']), float(row['Longitude'])
+        return None
+
+    def districts(self, state):
+        return sorted(self.markets.loc[self.markets['State'] == state, 'District'].unique())
+
+    def nearest(self, latitude, longitude, commodity=None, k=DEFAULT_NEAREST):
+        """The k nearest mandis to a point, nearest first, as a DataFrame
+
+        With a commodity only mandis that report it are searched, and each
+        row carries that commodity's latest arrival date and prices.
+        """
+        point = to_unit_vectors([latitude], [longitude])[0]
+        if commodity is None:
+            chords, rows = self.all_markets.query(point, k)
+            result = self.markets.iloc[rows][LOCATION_COLUMNS].reset_index(drop=True)
+            result.insert(3, 'distance_km', chord_to_km(chords))
+            return result
+        if commodity not in self.by_commodity:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        latest_rows, points = self.by_commodity[commodity]
+        chords, rows = points.query(point, k)
+        latest = self.latest.iloc[latest_rows[rows]].reset_index(drop=True)
+        result = self.markets.iloc[latest['market_id']][LOCATION_COLUMNS].reset_index(drop=True)
+        result['distance_km'] = chord_to_km(chords)
+        return pd.concat([result, latest.drop(columns='market_id')], axis=1)[RESULT_COLUMNS]
+
+
+def best_nearby(nearby):
+    """Row of the nearby mandis with the highest latest modal price, or None"""
+    if nearby.empty:
+        return None
+    return nearby.loc[nearby['Modal_x0020_Price'].idxmax()]
+
+
+def main():
+    import time
+
+    from price_data import PRICE_DATA_PATH, load_price_data
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--prices', default=PRICE_DATA_PATH, help='Agmarknet price CSV')
+    parser.add_argument('--near', nargs=2, type=float, metavar=('LAT', 'LON'), required=True)
+    parser.add_argument('--commodity', help='only mandis reporting this commodity')
+    parser.add_argument('-k', type=int, default=DEFAULT_NEAREST, help='number of mandis')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = MandiIndex(load_price_data(args.prices).frame)
+    print(f"{index.describe()}, built in {time.perf_counter() - started:.3f}s")
+    started = time.perf_counter()
+    nearby = index.nearest(*args.near, args.commodity, args.k)
+    print(f"Query took {(time.perf_counter() - started) * 1000:.2f} ms")
+    print(nearby.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
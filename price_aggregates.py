@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Materialized Dashboard aggregates over Agmarknet price rows
+
+Built once when price data is loaded and updated in place from newly
+ingested rows, touching only the commodities and states those rows
+belong to. The Dashboard renders from the stored views, so its cost does
+not grow with the number of price rows.
+"""
+
+import pandas as pd
+
+PRICE_COLUMN = 'Modal_x0020_Price'
+TOP_ROW_COLUMNS = ['Commodity', PRICE_COLUMN, 'State', 'Market', 'District']
+
+# Highest-priced rows kept per commodity
+TOP_ROWS_PER_COMMODITY = 3
+
+
+class DashboardAggregates:
+    """Per-commodity and per-state price aggregates with incremental refresh"""
+
+    def __init__(self, rows_per_commodity=TOP_ROWS_PER_COMMODITY):
+        self.rows_per_commodity = rows_per_commodity
+        self.commodity_sum = {}
+        self.commodity_count = {}
+        self.commodity_top = {}
+        self.state_count = {}
+        self.total_sum = 0
+        self.total_count = 0
+        self._best_rows = pd.DataFrame(columns=TOP_ROW_COLUMNS)
+        self._mean_prices = pd.Series(dtype=float, name=PRICE_COLUMN)
+
+    @classmethod
+    def from_frame(cls, frame, rows_per_commodity=TOP_ROWS_PER_COMMODITY):
+        """Build aggregates from a full price frame"""
+        aggregates = cls(rows_per_commodity)
+        aggregates.apply(frame)
+        return aggregates
+
+    def apply(self, rows):
+        """Fold newly ingested price rows into the aggregates; returns the commodities touched"""
+        if rows.empty:
+            return set()
+        prices = rows[PRICE_COLUMN]
+        self.total_sum += float(prices.sum())
+        self.total_count += int(prices.count())
+
+        grouped = prices.groupby(rows['Commodity'], observed=True, sort=False)
+        for commodity, total in grouped.sum().items():
+            self.commodity_sum[commodity] = self.commodity_sum.get(commodity, 0) + float(total)
+        for commodity, count in grouped.count().items():
+            self.commodity_count[commodity] = self.commodity_count.get(commodity, 0) + int(count)
+        for state, count in rows['State'].value_counts(sort=False).items():
+            if count:
+                self.state_count[state] = self.state_count.get(state, 0) + int(count)
+
+        # Per-commodity top rows: merge existing rows with the new candidates,
+        # keeping earlier rows first among equal prices
+        candidates = (rows[TOP_ROW_COLUMNS]
+                      .sort_values(PRICE_COLUMN, ascending=False, kind='stable')
+                      .groupby('Commodity', observed=True, sort=False).head(self.rows_per_commodity))
+        affected = set(candidates['Commodity'])
+        for commodity, group in candidates.groupby('Commodity', observed=True, sort=False):
+            merged = self.commodity_top.get(commodity, []) + group.to_dict('records')
+            merged.sort(key=lambda row: -row[PRICE_COLUMN])
+            self.commodity_top[commodity] = merged[:self.rows_per_commodity]
+
+        self._refresh_views()
+        return affected
+
+    def _refresh_views(self):
+        """Rebuild the small sorted views the Dashboard reads (one entry per commodity)"""
+        best = [rows[0] for rows in self.commodity_top.values() if rows]
+        self._best_rows = (pd.DataFrame(best, columns=TOP_ROW_COLUMNS)
+                           .sort_values(PRICE_COLUMN, ascending=False, kind='stable')
+                           .reset_index(drop=True))
+        means = {c: self.commodity_sum[c] / self.commodity_count[c] for c in self.commodity_count}
+        self._mean_prices = pd.Series(means, name=PRICE_COLUMN, dtype=float).sort_values(
+            ascending=False, kind='stable')
+
+    def top_commodities(self, n=10):
+        """Best market row for each of the n highest-priced distinct commodities"""
+        return self._best_rows.head(n)
+
+    def top_rows(self, commodity):
+        """Highest-priced rows kept for one commodity"""
+        return list(self.commodity_top.get(commodity, []))
+
+    def top_mean_prices(self, n=10):
+        """Mean modal price of the n commodities with the highest mean"""
+        return self._mean_prices.head(n)
+
+    @property
+    def commodity_total(self):
+        return len(self.commodity_count)
+
+    @property
+    def state_total(self):
+        return len(self.state_count)
+
+    @property
+    def average_price(self):
+        return self.total_sum / self.total_count if self.total_count else 0.0
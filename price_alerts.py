@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Price-threshold alerts for (Market, Commodity) pairs, matched on ingest
+
+Subscriptions ask to hear when a mandi's modal price crosses above or
+below a threshold. They are kept in SQLite and, in memory, grouped by
+(Market, Commodity) into sorted threshold arrays. When the price store
+writes new or changed rows, only the pairs those rows touch are looked up,
+and the subscriptions whose threshold lies between the previous and the new
+price are found by binary search. Matches go on a queue that a background
+thread delivers, so ingestion never waits on a delivery channel.
+
+    python price_alerts.py subscribe --market Ludhiana --commodity Potato --above 1200 --contact 9800000000
+    python price_alerts.py ingest agmarknet_prices.csv
+    python price_alerts.py list
+"""
+
+import argparse
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_ALERTS_PATH = os.path.join('.cache', 'price_alerts.sqlite')
+DIRECTIONS = ('above', 'below')
+PRICE_COLUMN = 'Modal_x0020_Price'
+QUEUE_SIZE = 10000
+
+SUBSCRIPTION_COLUMNS = ['id', 'market', 'commodity', 'direction', 'threshold', 'contact', 'created']
+ALERT_COLUMNS = ['subscription_id', 'contact', 'market', 'commodity', 'direction', 'threshold', 'price',
+                 'previous_price', 'arrival_date']
+# Counters bumped on every write to a shared table, so other processes know to reload it
+VERSIONED_TABLES = ('subscriptions', 'last_prices')
+
+
+def normalize_phone(phone):
+    """10-digit mobile number from typed input (spaces, dashes, +91 or 0 prefix allowed), or None"""
+    digits = re.sub(r'\D', '', str(phone or ''))
+    if len(digits) == 12 and digits.startswith('91'):
+        digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith('0'):
+        digits = digits[1:]
+    return digits if len(digits) == 10 else None
+
+
+class AlertBook:
+    """Subscriptions, the last price seen per (Market, Commodity) and the alert log, in one SQLite file"""
+
+    def __init__(self, path=DEFAULT_ALERTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS subscriptions ('
+            'id INTEGER PRIMARY KEY, market TEXT NOT NULL, commodity TEXT NOT NULL, direction TEXT NOT NULL, '
+            'threshold REAL NOT NULL, contact TEXT NOT NULL, created REAL NOT NULL, active INTEGER NOT NULL)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS last_prices ('
+            'market TEXT NOT NULL, commodity TEXT NOT NULL, price REAL NOT NULL, arrival_date TEXT NOT NULL, '
+            'PRIMARY KEY (market, commodity))')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS alerts ('
+            'id INTEGER PRIMARY KEY, subscription_id INTEGER NOT NULL, contact TEXT NOT NULL, market TEXT NOT NULL, '
+            'commodity TEXT NOT NULL, direction TEXT NOT NULL, threshold REAL NOT NULL, price REAL NOT NULL, '
+            'previous_price REAL, arrival_date TEXT NOT NULL, created REAL NOT NULL, delivered INTEGER NOT NULL, '
+            'error TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS alerts_contact ON alerts (contact, created)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._conn.executemany('INSERT OR IGNORE INTO versions VALUES (?, 0)', [(name,) for name in VERSIONED_TABLES])
+
+    def _write(self, table, sql, params, many=False):
+        """Run one write to a versioned table and bump its version in the same transaction"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = (self._conn.executemany if many else self._conn.execute)(sql, params)
+                self._conn.execute('UPDATE versions SET value = value + 1 WHERE name = ?', (table,))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return cursor
+
+    def versions(self):
+        """{table: write counter} for the tables other processes may change"""
+        with self._lock:
+            return dict(self._conn.execute('SELECT name, value FROM versions').fetchall())
+
+    def subscribe(self, market, commodity, direction, threshold, contact):
+        """Store an active subscription and return its id"""
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Unknown alert direction '{direction}', choose from {', '.join(DIRECTIONS)}")
+        cursor = self._write(
+            'subscriptions',
+            'INSERT INTO subscriptions (market, commodity, direction, threshold, contact, created, active) '
+            'VALUES (?, ?, ?, ?, ?, ?, 1)', (market, commodity, direction, float(threshold), contact, time.time()))
+        return cursor.lastrowid
+
+    def unsubscribe(self, subscription_id):
+        self._write('subscriptions', 'UPDATE subscriptions SET active = 0 WHERE id = ?', (subscription_id,))
+
+    def subscriptions(self, contact=None):
+        """Active subscriptions as a DataFrame, optionally for one contact"""
+        sql = f"SELECT {', '.join(SUBSCRIPTION_COLUMNS)} FROM subscriptions WHERE active = 1"
+        params = ()
+        if contact is not None:
+            sql, params = f"{sql} AND contact = ?", (contact,)
+        with self._lock:
+            rows = self._conn.execute(f"{sql} ORDER BY id", params).fetchall()
+        return pd.DataFrame(rows, columns=SUBSCRIPTION_COLUMNS)
+
+    def last_prices(self):
+        """{(market, commodity): (price, arrival date string)}"""
+        with self._lock:
+            rows = self._conn.execute('SELECT market, commodity, price, arrival_date FROM last_prices').fetchall()
+        return {(market, commodity): (price, day) for market, commodity, price, day in rows}
+
+    def save_prices(self, prices):
+        """Upsert {(market, commodity): (price, arrival date string)}"""
+        self._write('last_prices', 'INSERT OR REPLACE INTO last_prices VALUES (?, ?, ?, ?)',
+                    [(*key, price, day) for key, (price, day) in prices.items()], many=True)
+
+    def log_alert(self, alert, delivered, error=None):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO alerts ({', '.join(ALERT_COLUMNS)}, created, delivered, error) "
+                f"VALUES ({', '.join('?' * (len(ALERT_COLUMNS) + 3))})",
+                (*[alert[column] for column in ALERT_COLUMNS], time.time(), int(delivered), error))
+
+    def alerts(self, contact=None, limit=50):
+        """Most recent logged alerts, newest first"""
+        columns = [*ALERT_COLUMNS, 'created', 'delivered', 'error']
+        sql = f"SELECT {', '.join(columns)} FROM alerts"
+        params = ()
+        if contact is not None:
+            sql, params = f"{sql} WHERE contact = ?", (contact,)
+        with self._lock:
+            rows = self._conn.execute(f"{sql} ORDER BY created DESC, id DESC LIMIT ?", (*params, limit)).fetchall()
+        return pd.DataFrame(rows, columns=columns)
+
+
+def print_alert(alert):
+    """Default delivery channel: one line on stdout"""
+    print(f"Price alert for {alert['contact']}: {alert['commodity']} at {alert['market']} is "
+          f"₹{alert['price']:,.0f} on {alert['arrival_date']}, {alert['direction']} ₹{alert['threshold']:,.0f}")
+
+
+class PriceAlerts:
+    """Matches ingested price rows against subscriptions and delivers hits in the background
+
+    Attach to a PriceStore with attach(store); each ingest then calls
+    on_ingest with the rows it wrote. For every (Market, Commodity) the rows
+    touch, the day's median modal price is compared with the previous one:
+    'above' subscriptions fire for thresholds in (previous, price] and
+    'below' ones for thresholds in [price, previous). A pair seen for the
+    first time fires every subscription whose condition already holds.
+    Subscriptions and last prices written by other processes (the app, the
+    ingest CLIs) are picked up before each match.
+    """
+
+    def __init__(self, path=DEFAULT_ALERTS_PATH, deliver=print_alert, queue_size=QUEUE_SIZE):
+        self.book = AlertBook(path)
+        self.deliver = deliver
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(queue_size)
+        self._worker = None
+        self.matched = 0
+        self.dropped = 0
+        self.versions = self.book.versions()
+        self.last_prices = self.book.last_prices()
+        self.reload()
+
+    def reload(self):
+        """Rebuild the sorted threshold arrays from the active subscriptions"""
+        self.versions['subscriptions'] = self.book.versions()['subscriptions']
+        subscriptions = self.book.subscriptions()
+        index = {}
+        for (market, commodity, direction), group in subscriptions.groupby(['market', 'commodity', 'direction']):
+            group = group.sort_values(['threshold', 'id'])
+            index.setdefault((market, commodity), {})[direction] = (group['threshold'].to_numpy(dtype=np.float64),
+                                                                    group['id'].to_numpy(dtype=np.int64))
+        contacts = dict(zip(subscriptions['id'], subscriptions['contact']))
+        with self._lock:
+            self.index, self.contacts = index, contacts
+
+    def subscribe(self, market, commodity, direction, threshold, contact):
+        """Add a subscription and insert it into its pair's sorted thresholds; returns its id"""
+        subscription_id = self.book.subscribe(market, commodity, direction, threshold, contact)
+        with self._lock:
+            entry = self.index.setdefault((market, commodity), {})
+            thresholds, ids = entry.get(direction, (np.empty(0), np.empty(0, dtype=np.int64)))
+            at = np.searchsorted(thresholds, threshold, side='right')
+            entry[direction] = np.insert(thresholds, at, threshold), np.insert(ids, at, subscription_id)
+            self.contacts[subscription_id] = contact
+        return subscription_id
+
+    def unsubscribe(self, subscription_id):
+        self.book.unsubscribe(subscription_id)
+        self.reload()
+
+    def sync(self):
+        """Reload subscriptions and last prices if another process changed them"""
+        versions = self.book.versions()
+        if versions['subscriptions'] != self.versions['subscriptions']:
+            self.reload()
+        if versions['last_prices'] != self.versions['last_prices']:
+            stored = self.book.last_prices()
+            with self._lock:
+                # Keep in-memory prices still waiting to be saved when they are newer
+                for key, (price, day) in stored.items():
+                    if day > self.last_prices.get(key, (None, ''))[1]:
+                        self.last_prices[key] = (price, day)
+                self.versions['last_prices'] = versions['last_prices']
+
+    def attach(self, store):
+        """Evaluate subscriptions on every ingest into store"""
+        if self.on_ingest not in store.listeners:
+            store.listeners.append(self.on_ingest)
+        return self
+
+    def match(self, rows, frame=None):
+        """Alerts for the (Market, Commodity) pairs in rows, updating the last seen prices
+
+        Prices come from frame, the whole ingested batch, when given, so a
+        pair with one changed row among several is still priced on all of them.
+        """
+        if rows is None or rows.empty:
+            return []
+        self.sync()
+        if frame is not None:
+            touched = pd.MultiIndex.from_frame(rows[['Market', 'Commodity']].astype(str)).unique()
+            rows = frame[pd.MultiIndex.from_frame(frame[['Market', 'Commodity']].astype(str)).isin(touched)]
+        daily = rows.groupby(['Market', 'Commodity', 'Arrival_Date'], observed=True)[PRICE_COLUMN].median()
+        # Only each pair's latest day in the batch can move its current price
+        latest = daily.reset_index().drop_duplicates(['Market', 'Commodity'], keep='last')
+        alerts = []
+        updated = {}
+        with self._lock:
+            for market, commodity, arrival, price in latest.itertuples(index=False):
+                key, day = (str(market), str(commodity)), arrival.strftime('%Y-%m-%d')
+                previous, previous_day = self.last_prices.get(key, (None, ''))
+                if day < previous_day:
+                    continue
+                updated[key] = (float(price), day)
+                entry = self.index.get(key)
+                if not entry:
+                    continue
+                for direction, (thresholds, ids) in entry.items():
+                    if direction == 'above':
+                        low = 0 if previous is None else np.searchsorted(thresholds, previous, side='right')
+                        high = np.searchsorted(thresholds, price, side='right')
+                    else:
+                        low = np.searchsorted(thresholds, price, side='left')
+                        high = len(thresholds) if previous is None else np.searchsorted(thresholds, previous, side='left')
+                    for threshold, subscription_id in zip(thresholds[low:high], ids[low:high]):
+                        alerts.append({'subscription_id': int(subscription_id), 'contact': self.contacts[subscription_id],
+                                       'market': key[0], 'commodity': key[1], 'direction': direction,
+                                       'threshold': float(threshold), 'price': float(price),
+                                       'previous_price': previous, 'arrival_date': day})
+            self.last_prices.update(updated)
+            self.matched += len(alerts)
+        self._enqueue(('prices', updated))
+        for alert in alerts:
+            self._enqueue(('alert', alert))
+        return alerts
+
+    def on_ingest(self, rows, frame=None):
+        """PriceStore listener: match the written rows and queue what fires"""
+        try:
+            self.match(rows, frame)
+        except Exception as e:
+            print(f"Price alert match error: {e}")
+
+    def _enqueue(self, job):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='price-alerts', daemon=True)
+            self._worker.start()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.dropped += 1
+            print(f"Price alert queue full, dropped {job[0]}")
+
+    def _run(self):
+        while True:
+            kind, payload = self._queue.get()
+            try:
+                if kind == 'prices':
+                    self.book.save_prices(payload)
+                else:
+                    try:
+                        self.deliver(payload)
+                        self.book.log_alert(payload, True)
+                    except Exception as e:
+                        print(f"Price alert delivery error: {e}")
+                        self.book.log_alert(payload, False, str(e))
+            except Exception as e:
+                print(f"Price alert error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait until every queued alert has been delivered"""
+        self._queue.join()
+
+    def stats(self):
+        subscriptions = sum(len(ids) for entry in self.index.values() for _, ids in entry.values())
+        return {'subscriptions': subscriptions, 'pairs': len(self.index), 'matched': self.matched,
+                'queued': self._queue.qsize(), 'dropped': self.dropped}
+
+
+def main():
+    from price_forecast import refresh_forecasts
+    from price_store import DEFAULT_STORE_PATH, PriceStore
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--alerts', default=DEFAULT_ALERTS_PATH, help='alert database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    subscribe = commands.add_parser('subscribe', help='add a price-threshold subscription')
+    subscribe.add_argument('--market', required=True)
+    subscribe.add_argument('--commodity', required=True)
+    condition = subscribe.add_mutually_exclusive_group(required=True)
+    condition.add_argument('--above', type=float, help='alert when the modal price rises to this or higher')
+    condition.add_argument('--below', type=float, help='alert when the modal price falls to this or lower')
+    subscribe.add_argument('--contact', required=True)
+    unsubscribe = commands.add_parser('unsubscribe', help='deactivate a subscription')
+    unsubscribe.add_argument('id', type=int)
+    ingest = commands.add_parser('ingest', help='ingest snapshot CSVs into the store and deliver alerts')
+    ingest.add_argument('paths', nargs='+')
+    ingest.add_argument('--store', default=DEFAULT_STORE_PATH, help='price store directory')
+    listing = commands.add_parser('list', help='show subscriptions and recent alerts')
+    listing.add_argument('--contact')
+    args = parser.parse_args()
+
+    alerts = PriceAlerts(args.alerts)
+    if args.command == 'subscribe':
+        direction, threshold = ('above', args.above) if args.above is not None else ('below', args.below)
+        subscription_id = alerts.subscribe(args.market, args.commodity, direction, threshold,
+                                           normalize_phone(args.contact) or args.contact)
+        print(f"Subscription {subscription_id}: {args.commodity} at {args.market} {direction} ₹{threshold:,.0f}")
+    elif args.command == 'unsubscribe':
+        alerts.unsubscribe(args.id)
+    elif args.command == 'ingest':
+        store = PriceStore(args.store)
+        version = store.version
+        alerts.attach(store)
+        for path in args.paths:
+            started = time.perf_counter()
+            result = store.ingest(path)
+            print(f"{path}: {result['added']:,} added, {result['changed']:,} changed, "
+                  f"{result['skipped']:,} skipped in {time.perf_counter() - started:.2f}s")
+        alerts.flush()
+        print(alerts.stats())
+        if store.version != version:
+            refresh_forecasts(store)
+    else:
+        contact = normalize_phone(args.contact) or args.contact
+        print(alerts.book.subscriptions(contact).to_string(index=False))
+        print(alerts.book.alerts(contact).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
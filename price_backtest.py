@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Rolling-origin backtest of the price forecasting models
+
+History is cut at several origins; at each one every model is fitted to
+all series at once (in parallel, as in the nightly forecast job) and its
+forecasts are scored against the prices recorded afterwards. The result is
+a per-commodity leaderboard of MAPE, interval coverage and fit cost, from
+which the cheapest model that is still accurate enough can be picked.
+
+    python price_backtest.py --store price_store --origins 4 --horizon 7
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from crop_data import write_json_atomic
+from price_forecast import AR_ORDER, INTERVAL_LEVEL, MODELS, PriceSeries, fit_forecasts
+from price_store import DEFAULT_STORE_PATH, PriceStore
+
+DEFAULT_HORIZON = 7
+DEFAULT_ORIGINS = 4
+DEFAULT_STEP = 7
+# Shortest training history worth scoring (enough for the AR fit)
+MIN_TRAIN_DAYS = 2 * (AR_ORDER + 1)
+# A model is "accurate enough" within this fraction of the best MAPE for its commodity
+MAPE_TOLERANCE = 0.1
+
+SELECTED = 'selected'
+LEADERBOARD_COLUMNS = ['commodity', 'model', 'mape', 'coverage', 'points', 'series', 'fit_ms_per_series']
+
+
+def backtest_origins(days, horizon=DEFAULT_HORIZON, origins=DEFAULT_ORIGINS, step=DEFAULT_STEP):
+    """Training lengths for each rolling origin, oldest first"""
+    candidates = [days - horizon - k * step for k in range(origins)]
+    return sorted(origin for origin in candidates if origin >= MIN_TRAIN_DAYS)
+
+
+def run_backtest(series, horizon=DEFAULT_HORIZON, origins=DEFAULT_ORIGINS, step=DEFAULT_STEP,
+                 workers=None, progress=None):
+    """Score every model at every rolling origin and return the per-commodity leaderboard
+
+    The "selected" model is the per-series choice the forecast job makes.
+    progress, if given, is called with (origins done, total origins).
+    """
+    values = series.values
+    cuts = backtest_origins(values.shape[1], horizon, origins, step)
+    commodity_codes, commodities = pd.factorize(pd.Index([key[2] for key in series.keys]))
+    names = [*MODELS, SELECTED]
+    error_sum = np.zeros((len(names), len(commodities)))
+    covered = np.zeros_like(error_sum)
+    points = np.zeros_like(error_sum)
+    scored_series = np.zeros_like(error_sum)
+    fit_ms = dict.fromkeys(MODELS, 0.0)
+
+    for done, origin in enumerate(cuts, 1):
+        train = PriceSeries(values[:, :origin], series.keys, series.start_date, series.observed[:, :origin])
+        forecasts = fit_forecasts(train, horizon, workers)
+        actual = values[:, origin:origin + horizon]
+        # Score only recorded prices, not carried-forward gaps
+        recorded = series.observed[:, origin:origin + horizon] & (actual > 0)
+        width = actual.shape[1]
+        rows = np.arange(len(series))
+        best = np.maximum(forecasts.best, 0)
+        for m, name in enumerate(names):
+            if name == SELECTED:
+                point, lower, upper = (forecasts.point[rows, best], forecasts.lower[rows, best],
+                                       forecasts.upper[rows, best])
+                fitted = forecasts.best >= 0
+            else:
+                point, lower, upper = forecasts.point[:, m], forecasts.lower[:, m], forecasts.upper[:, m]
+                fitted = np.isfinite(forecasts.sigma[:, m])
+                fit_ms[name] += forecasts.meta['fit_ms_per_series'][name]
+            valid = recorded & fitted[:, None]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ape = np.where(valid, np.abs(actual - point[:, :width]) / actual, 0.0)
+            inside = valid & (actual >= lower[:, :width]) & (actual <= upper[:, :width])
+            error_sum[m] += np.bincount(commodity_codes, ape.sum(axis=1), len(commodities))
+            covered[m] += np.bincount(commodity_codes, inside.sum(axis=1), len(commodities))
+            points[m] += np.bincount(commodity_codes, valid.sum(axis=1), len(commodities))
+            scored_series[m] += np.bincount(commodity_codes, valid.any(axis=1), len(commodities))
+        if progress is not None:
+            progress(done, len(cuts))
+
+    records = []
+    for m, name in enumerate(names):
+        cost = fit_ms[name] / len(cuts) if name in fit_ms and cuts else np.nan
+        for c, commodity in enumerate(commodities):
+            if points[m, c]:
+                records.append((commodity, name, error_sum[m, c] / points[m, c], covered[m, c] / points[m, c],
+                                int(points[m, c]), int(scored_series[m, c]), cost))
+    leaderboard = pd.DataFrame(records, columns=LEADERBOARD_COLUMNS)
+    return leaderboard.sort_values(['commodity', 'mape'], kind='stable').reset_index(drop=True)
+
+
+def overall(leaderboard):
+    """Point-weighted MAPE and coverage per model across all commodities"""
+    weighted = leaderboard.assign(error=leaderboard['mape'] * leaderboard['points'],
+                                  inside=leaderboard['coverage'] * leaderboard['points'])
+    totals = weighted.groupby('model', sort=False).agg(
+        error=('error', 'sum'), inside=('inside', 'sum'), points=('points', 'sum'),
+        series=('series', 'sum'), fit_ms_per_series=('fit_ms_per_series', 'first'))
+    return pd.DataFrame({'mape': totals['error'] / totals['points'], 'coverage': totals['inside'] / totals['points'],
+                         'points': totals['points'], 'fit_ms_per_series': totals['fit_ms_per_series']}
+                        ).sort_values('mape', kind='stable')
+
+
+def choose_models(leaderboard, tolerance=MAPE_TOLERANCE):
+    """Cheapest model per commodity whose MAPE is within tolerance of the best"""
+    models = leaderboard[leaderboard['model'] != SELECTED]
+    best = models.groupby('commodity', sort=False)['mape'].transform('min')
+    eligible = models[models['mape'] <= best * (1 + tolerance)]
+    cheapest = eligible.sort_values(['commodity', 'fit_ms_per_series', 'mape'], kind='stable')
+    return cheapest.groupby('commodity', sort=False).head(1).set_index('commodity')['model']
+
+
+def backtest_path(store):
+    return os.path.join(store.root, 'backtest.json')
+
+
+def save_leaderboard(store, leaderboard, settings):
+    """Write the leaderboard next to the store, tagged with the store version"""
+    write_json_atomic(backtest_path(store), dict(
+        settings, store_version=store.version, created=time.time(),
+        columns=LEADERBOARD_COLUMNS, rows=leaderboard[LEADERBOARD_COLUMNS].values.tolist()))
+
+
+def load_leaderboard(store):
+    """The last saved leaderboard and its settings, or (None, None)"""
+    try:
+        with open(backtest_path(store)) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return None, None
+    except (OSError, ValueError) as e:
+        print(f"Backtest read error: {e}")
+        return None, None
+    rows = saved.pop('rows')
+    return pd.DataFrame(rows, columns=saved.pop('columns')), saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='price store directory')
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON, help='days scored after each origin')
+    parser.add_argument('--origins', type=int, default=DEFAULT_ORIGINS, help='number of rolling origins')
+    parser.add_argument('--step', type=int, default=DEFAULT_STEP, help='days between origins')
+    parser.add_argument('--workers', type=int, help='fitting processes (default: FORECAST_WORKERS or CPU count)')
+    parser.add_argument('--tolerance', type=float, default=MAPE_TOLERANCE,
+                        help='fraction of the best MAPE a cheaper model may exceed it by')
+    parser.add_argument('--output', help='also write the leaderboard to this CSV')
+    args = parser.parse_args()
+
+    store = PriceStore(args.store)
+    started = time.perf_counter()
+    series = PriceSeries.from_store(store)
+    cuts = backtest_origins(series.values.shape[1], args.horizon, args.origins, args.step)
+    if not cuts:
+        parser.exit(1, f"Need at least {MIN_TRAIN_DAYS + args.horizon} days of history, "
+                       f"the store has {series.values.shape[1]}\n")
+
+    def progress(done, total):
+        print(f"Origin {done}/{total} scored ({time.perf_counter() - started:.1f}s)")
+
+    leaderboard = run_backtest(series, args.horizon, args.origins, args.step, args.workers, progress)
+    save_leaderboard(store, leaderboard, {'horizon': args.horizon, 'origins': len(cuts), 'step': args.step,
+                                          'interval_level': INTERVAL_LEVEL})
+    if args.output:
+        leaderboard.to_csv(args.output, index=False)
+
+    print(f"\nAll commodities ({len(series):,} series, {len(cuts)} origins, {args.horizon}-day horizon, "
+          f"{INTERVAL_LEVEL:.0%} intervals)")
+    print(overall(leaderboard).to_string(float_format=lambda x: f"{x:.3f}"))
+    choices = choose_models(leaderboard, args.tolerance)
+    print(f"\nCheapest model within {args.tolerance:.0%} of the best MAPE: {choices.value_counts().to_dict()}")
+    print(f"Wrote {len(leaderboard):,} leaderboard rows to {backtest_path(store)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Process-wide loader for agmarknet_prices.csv
+
+The CSV is parsed once per process and the same frame is handed to every
+Streamlit session and rerun. It is re-parsed only when the file's size or
+mtime changes and its SHA-256 no longer matches; when the old contents are
+an unchanged prefix of the new file, only the appended rows are parsed.
+A replaced file is compared row by row on the natural key, and if it only
+inserts rows, just those are folded into the Dashboard aggregates.
+"""
+
+import copy
+import io
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+from crop_data import file_digest, file_fingerprint
+from price_aggregates import DashboardAggregates
+from price_index import PriceIndex
+
+PRICE_DATA_PATH = 'agmarknet_prices.csv'
+ARRIVAL_DATE_FORMAT = '%d/%m/%Y'
+
+# Repetitive text columns are dictionary-encoded; prices fit in int32
+CATEGORY_COLUMNS = ['State', 'District', 'Market', 'Commodity', 'Variety', 'Grade']
+PRICE_COLUMNS = ['Min_x0020_Price', 'Max_x0020_Price', 'Modal_x0020_Price']
+PRICE_DTYPES = dict({column: 'category' for column in CATEGORY_COLUMNS},
+                    **{column: np.int32 for column in PRICE_COLUMNS})
+# A mandi price row is identified by these columns; its prices are the payload
+NATURAL_KEY = ['State', 'District', 'Market', 'Commodity', 'Variety', 'Grade', 'Arrival_Date']
+
+
+class PriceData:
+    """A parsed price file plus when and how fast it was loaded
+
+    frame is shared by every caller and must be treated as read-only;
+    copy it before modifying.
+    """
+
+    def __init__(self, frame, path, fingerprint, sha256, load_seconds, aggregates=None, index=None):
+        self.frame = frame
+        self.aggregates = aggregates if aggregates is not None else DashboardAggregates.from_frame(frame)
+        self.index = index if index is not None else PriceIndex(frame)
+        self.path = path
+        self.fingerprint = fingerprint
+        self.sha256 = sha256
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        latest = frame['Arrival_Date'].max()
+        self.latest_arrival = None if pd.isna(latest) else latest.to_pydatetime()
+
+    @property
+    def age_seconds(self):
+        """Seconds since the frame was parsed"""
+        return time.time() - self.loaded_at
+
+    @property
+    def file_age_seconds(self):
+        """Seconds since the price file was last modified"""
+        return time.time() - self.fingerprint[1] / 1e9
+
+    def describe(self):
+        """One-line summary of load time and data age for display"""
+        latest = self.latest_arrival
+        arrival = f", latest arrivals {latest:%d %b %Y}" if latest else ''
+        return (f"{len(self.frame):,} price rows loaded in {self.load_seconds * 1000:.0f} ms, "
+                f"file updated {format_age(self.file_age_seconds)} ago{arrival}")
+
+    def memory_report(self):
+        """Bytes per row of the compact frame versus plain object columns"""
+        rows = max(1, len(self.frame))
+        compact = self.frame.memory_usage(deep=True, index=False).sum()
+        plain = sum(self.frame[column].astype(object).memory_usage(deep=True, index=False)
+                    if column in CATEGORY_COLUMNS else self.frame[column].astype(np.int64).memory_usage(index=False)
+                    if column in PRICE_COLUMNS else self.frame[column].memory_usage(deep=True, index=False)
+                    for column in self.frame.columns)
+        return {'rows': len(self.frame), 'object_bytes_per_row': plain / rows,
+                'compact_bytes_per_row': compact / rows, 'ratio': compact / plain if plain else 1.0}
+
+
+def format_age(seconds):
+    """Human-readable age such as '5 min' or '3 days'"""
+    for unit, size in (('days', 86400), ('h', 3600), ('min', 60)):
+        if seconds >= size:
+            return f"{seconds / size:.0f} {unit}"
+    return f"{seconds:.0f} s"
+
+
+def compact_price_frame(frame):
+    """Categorical text columns, int32 prices and datetime64 Arrival_Date"""
+    frame = frame.astype({column: dtype for column, dtype in PRICE_DTYPES.items() if column in frame})
+    if 'Arrival_Date' in frame and not pd.api.types.is_datetime64_any_dtype(frame['Arrival_Date']):
+        frame['Arrival_Date'] = pd.to_datetime(frame['Arrival_Date'], format=ARRIVAL_DATE_FORMAT)
+    return frame
+
+
+def read_price_csv(path):
+    """Parse an Agmarknet price CSV into the compact representation"""
+    return compact_price_frame(pd.read_csv(path, dtype=PRICE_DTYPES))
+
+
+def read_appended_rows(path, offset, columns):
+    """Parse the rows written to a price CSV after its first offset bytes"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        tail = f.read()
+    return compact_price_frame(pd.read_csv(io.BytesIO(tail), header=None, names=list(columns), dtype=PRICE_DTYPES))
+
+
+def concat_price_frames(frames):
+    """Concatenate compact price frames, keeping categorical columns categorical
+
+    Categories are unioned in first-seen order, so existing codes never change.
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame()
+    frames = [frame.copy(deep=False) for frame in frames]
+    for column in CATEGORY_COLUMNS:
+        if column not in frames[0]:
+            continue
+        categories = pd.Index([])
+        for frame in frames:
+            categories = categories.append(pd.Index(frame[column].cat.categories).difference(categories, sort=False))
+        dtype = CategoricalDtype(categories)
+        for frame in frames:
+            frame[column] = frame[column].astype(dtype)
+    return pd.concat(frames, ignore_index=True)
+
+
+def row_hashes(frame):
+    """64-bit hashes of each row's natural key and of its prices
+
+    Categorical columns hash by value, so hashes agree across frames with
+    different categories.
+    """
+    keys = pd.util.hash_pandas_object(frame[NATURAL_KEY], index=False).to_numpy()
+    values = pd.util.hash_pandas_object(frame[PRICE_COLUMNS], index=False).to_numpy()
+    return keys, values
+
+
+def diff_rows(old, new):
+    """Compare two price frames by natural key
+
+    Returns (mask of inserted rows in new, changed count, unchanged count,
+    count of old rows missing from new).
+    """
+    old_keys, old_values = row_hashes(old)
+    new_keys, new_values = row_hashes(new)
+    old_prices = pd.Series(old_values, index=old_keys)
+    old_prices = old_prices[~old_prices.index.duplicated(keep='last')]
+    known = np.isin(new_keys, old_keys)
+    unchanged = np.zeros(len(new), dtype=bool)
+    unchanged[known] = old_prices.reindex(new_keys[known]).to_numpy() == new_values[known]
+    removed = int((~np.isin(old_prices.index.to_numpy(), new_keys)).sum())
+    return ~known, int((known & ~unchanged).sum()), int(unchanged.sum()), removed
+
+
+def _ends_with_newline(path, size):
+    with open(path, 'rb') as f:
+        f.seek(size - 1)
+        return f.read(1) == b'\n'
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_price_data(path=PRICE_DATA_PATH):
+    """Return the shared PriceData for path, re-parsing only if the file changed"""
+    key = os.path.abspath(path)
+    fingerprint = file_fingerprint(path)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached.fingerprint == fingerprint:
+            return cached
+        sha256 = file_digest(path)
+        if cached is not None and cached.sha256 == sha256:
+            # Touched but unchanged
+            cached.fingerprint = fingerprint
+            return cached
+
+        started = time.perf_counter()
+        old_size = cached.fingerprint[0] if cached is not None else 0
+        appended = frame = None
+        if (cached is not None and fingerprint[0] > old_size > 0 and _ends_with_newline(path, old_size)
+                and file_digest(path, limit=old_size) == cached.sha256):
+            # Rows were appended: parse only the tail
+            appended = read_appended_rows(path, old_size, cached.frame.columns)
+        elif cached is not None:
+            # Replaced file: if every cached row is still there unchanged, only the inserted rows are new
+            frame = read_price_csv(path)
+            inserted, changed, unchanged, removed = diff_rows(cached.frame, frame)
+            print(f"{path} changed: {int(inserted.sum()):,} rows added, {changed:,} changed, "
+                  f"{unchanged:,} skipped, {removed:,} removed")
+            if not changed and not removed:
+                appended = frame[inserted]
+        if appended is not None:
+            # Update aggregates and the index for the new rows alone
+            frame = concat_price_frames([cached.frame, appended])
+            aggregates = copy.deepcopy(cached.aggregates)
+            aggregates.apply(appended)
+            index = cached.index.extended(frame, len(cached.frame))
+            price_data = PriceData(frame, path, fingerprint, sha256, time.perf_counter() - started,
+                                   aggregates, index)
+        else:
+            frame = read_price_csv(path) if frame is None else frame
+            price_data = PriceData(frame, path, fingerprint, sha256, time.perf_counter() - started)
+        _cache[key] = price_data
+        print(f"Loaded {path} at {datetime.now():%H:%M:%S}: {price_data.describe()}")
+        if cached is None:
+            report = price_data.memory_report()
+            print(f"Price data memory: {report['object_bytes_per_row']:.0f} bytes/row as objects, "
+                  f"{report['compact_bytes_per_row']:.0f} bytes/row compact")
+        return price_data
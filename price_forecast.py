@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+Batch price forecasts for every (State, Market, Commodity) series
+
+Daily modal prices from the price store are laid out as one row per series
+on a shared calendar, and seasonal naive, simple exponential smoothing and
+AR(p) models are fitted to all rows at once with array operations. Point
+forecasts and prediction intervals are written next to the store and only
+recomputed when the store changes, so the Price page does a lookup. The
+ingest commands refit at the end of their run; a long-running process can
+attach a ForecastRefresher to its store to refit in the background instead.
+
+    python price_forecast.py --store price_store
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from crop_data import write_json_atomic
+from price_store import DEFAULT_STORE_PATH, PriceStore
+
+MODELS = ('seasonal_naive', 'ses', 'ar')
+FORECAST_VERSION = 1
+FORECAST_ARRAYS = ('point', 'lower', 'upper', 'sigma', 'best', 'last_value')
+FORECAST_DTYPE = np.float32
+
+DEFAULT_HORIZON = 30
+SEASON_LENGTH = 7
+AR_ORDER = 7
+SES_ALPHAS = np.linspace(0.05, 0.95, 19)
+# Two-sided 80% normal interval
+INTERVAL_LEVEL = 0.8
+INTERVAL_Z = 1.2816
+RIDGE = 1e-6
+
+# Series per scheduled chunk; pools are only started when there are enough series
+CHUNK_SERIES = 2048
+MIN_PARALLEL_SERIES = 8192
+MAX_REPORTED_FAILURES = 100
+
+
+class PriceSeries:
+    """Daily modal prices, one row per (State, Market, Commodity), NaN before a series starts
+
+    observed marks the days with a recorded price, as opposed to carried-forward gaps.
+    """
+
+    def __init__(self, values, keys, start_date, observed=None):
+        self.values = values
+        self.keys = keys
+        self.start_date = pd.Timestamp(start_date)
+        self.observed = np.isfinite(values) if observed is None else observed
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def end_date(self):
+        return self.start_date + pd.Timedelta(days=self.values.shape[1] - 1)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Mean modal price per series and arrival date, gaps carried forward"""
+        if frame.empty:
+            return cls(np.empty((0, 0)), [], pd.Timestamp.today().normalize())
+        daily = frame.groupby(['State', 'Market', 'Commodity', 'Arrival_Date'], observed=True,
+                              sort=False)['Modal_x0020_Price'].mean()
+        codes, keys = pd.factorize(daily.index.droplevel('Arrival_Date'))
+        dates = daily.index.get_level_values('Arrival_Date')
+        start = dates.min()
+        offsets = np.asarray((dates - start).days)
+        values = np.full((len(keys), offsets.max() + 1), np.nan)
+        values[codes, offsets] = daily.to_numpy(dtype=np.float64)
+        return cls(fill_forward(values), [tuple(key) for key in keys], start, np.isfinite(values))
+
+    @classmethod
+    def from_store(cls, store):
+        return cls.from_frame(store.query())
+
+
+def fill_forward(values):
+    """Carry the last observation over gaps in every row; leading NaNs stay NaN"""
+    if values.size == 0:
+        return values
+    steps = np.arange(values.shape[1])
+    last_valid = np.where(np.isnan(values), 0, steps)
+    np.maximum.accumulate(last_valid, axis=1, out=last_valid)
+    return values[np.arange(len(values))[:, None], last_valid]
+
+
+def _lagged(values, lag):
+    """values shifted right by lag along time, NaN where there is no earlier value"""
+    shifted = np.full_like(values, np.nan)
+    if lag < values.shape[1]:
+        shifted[:, lag:] = values[:, :values.shape[1] - lag]
+    return shifted
+
+
+def _rmse(residuals, dof=0):
+    """Root mean square of the finite residuals per row; NaN with fewer than two"""
+    count = np.sum(np.isfinite(residuals), axis=1)
+    sse = np.nansum(residuals ** 2, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count - dof >= 2, np.sqrt(sse / np.maximum(count - dof, 1)), np.nan)
+
+
+def fit_seasonal_naive(values, horizon, season=SEASON_LENGTH):
+    """Repeat the last season; returns (point, standard error per step, sigma)"""
+    n, T = values.shape
+    sigma = _rmse(values - _lagged(values, season))
+    point = np.full((n, horizon), np.nan)
+    if T >= season:
+        steps = T - season + np.arange(horizon) % season
+        point = values[:, steps]
+    cycles = np.arange(horizon) // season + 1
+    return point, sigma[:, None] * np.sqrt(cycles), sigma
+
+
+def fit_ses(values, horizon, alphas=SES_ALPHAS):
+    """Simple exponential smoothing with the smoothing weight chosen per series from a grid"""
+    n, T = values.shape
+    level = np.full((n, len(alphas)), np.nan)
+    sse = np.zeros((n, len(alphas)))
+    count = np.zeros(n)
+    for t in range(T):
+        y = values[:, t, None]
+        error = y - level
+        seen = np.isfinite(error[:, 0])
+        sse[seen] += error[seen] ** 2
+        count += seen
+        level = np.where(np.isnan(level), y, level + alphas * np.nan_to_num(error))
+    best = np.argmin(sse, axis=1)
+    rows = np.arange(n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma = np.where(count >= 2, np.sqrt(sse[rows, best] / np.maximum(count, 1)), np.nan)
+    alpha = alphas[best]
+    point = np.repeat(level[rows, best][:, None], horizon, axis=1)
+    spread = np.sqrt(1 + np.arange(horizon)[None, :] * alpha[:, None] ** 2)
+    return point, sigma[:, None] * spread, sigma
+
+
+def fit_ar(values, horizon, order=AR_ORDER):
+    """AR(order) with intercept by least squares, solved for all series at once"""
+    n, T = values.shape
+    columns = [np.ones_like(values)] + [_lagged(values, k) for k in range(1, order + 1)]
+    valid = np.isfinite(values) & np.isfinite(columns[-1])
+    columns = [np.where(valid, column, 0.0) for column in columns]
+    target = np.where(valid, values, 0.0)
+
+    # Normal equations from lag cross-products, so memory stays O(series x days)
+    size = order + 1
+    gram = np.empty((n, size, size))
+    moment = np.empty((n, size))
+    for i in range(size):
+        moment[:, i] = np.sum(columns[i] * target, axis=1)
+        for j in range(i, size):
+            gram[:, i, j] = gram[:, j, i] = np.sum(columns[i] * columns[j], axis=1)
+    scale = np.maximum(np.einsum('nii->n', gram), 1.0)
+    gram += RIDGE * scale[:, None, None] * np.eye(size)
+    coefficients = np.linalg.solve(gram, moment[..., None])[..., 0]
+
+    fitted = sum(coefficients[:, i, None] * columns[i] for i in range(size))
+    residuals = np.where(valid, values - fitted, np.nan)
+    observations = valid.sum(axis=1)
+    sigma = np.where(observations >= 2 * size, _rmse(residuals, dof=size), np.nan)
+
+    # Recursive forecasts and psi weights for the interval widths
+    history = values[:, T - order:] if T >= order else np.full((n, order), np.nan)
+    history = history.copy()
+    phi = coefficients[:, 1:]
+    point = np.empty((n, horizon))
+    psi = np.zeros((n, horizon))
+    psi[:, 0] = 1.0
+    for h in range(horizon):
+        point[:, h] = coefficients[:, 0] + np.sum(phi * history[:, ::-1], axis=1)
+        history = np.concatenate([history[:, 1:], point[:, h, None]], axis=1)
+        if h:
+            lags = min(h, order)
+            psi[:, h] = np.sum(phi[:, :lags] * psi[:, h - 1::-1][:, :lags], axis=1)
+    spread = np.sqrt(np.cumsum(psi ** 2, axis=1))
+
+    # Reject explosive fits rather than show them
+    observed_max = np.nanmax(np.abs(values), axis=1, initial=0.0)
+    unstable = ~np.all(np.abs(point) <= 10 * observed_max[:, None], axis=1)
+    sigma[unstable] = np.nan
+    return point, sigma[:, None] * spread, sigma
+
+
+FITTERS = {'seasonal_naive': fit_seasonal_naive, 'ses': fit_ses, 'ar': fit_ar}
+
+
+class ForecastSet:
+    """Point forecasts and prediction intervals for every series and model
+
+    best holds the model index with the lowest in-sample one-step error per
+    series, or -1 when the history is too short for any model; those series
+    forecast their last price with no interval.
+    """
+
+    def __init__(self, keys, start_date, point, lower, upper, sigma, best, last_value, meta=None):
+        self.keys = [tuple(key) for key in keys]
+        self.start_date = pd.Timestamp(start_date)
+        self.point = point
+        self.lower = lower
+        self.upper = upper
+        self.sigma = sigma
+        self.best = best
+        self.last_value = last_value
+        self.meta = meta or {}
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def horizon(self):
+        return self.point.shape[2]
+
+    def forecast(self, state, market, commodity, model=None):
+        """Forecast table for one series (dates x forecast/lower/upper) and the model used
+
+        Returns (None, None) for a series with no price history.
+        """
+        i = self.positions.get((state, market, commodity))
+        if i is None:
+            return None, None
+        m = MODELS.index(model) if model else int(self.best[i])
+        dates = pd.date_range(self.start_date, periods=self.horizon, freq='D', name='Date')
+        if m < 0 or not np.isfinite(self.sigma[i, m]):
+            flat = np.full(self.horizon, self.last_value[i])
+            return pd.DataFrame({'forecast': flat, 'lower': np.nan, 'upper': np.nan}, index=dates), 'last price'
+        return pd.DataFrame({'forecast': self.point[i, m], 'lower': self.lower[i, m],
+                             'upper': self.upper[i, m]}, index=dates), MODELS[m]
+
+    def model_counts(self):
+        """How many series each model was selected for"""
+        chosen = pd.Series(self.best).map(dict(enumerate(MODELS))).fillna('last price')
+        return chosen.value_counts().to_dict()
+
+    def save(self, directory, version):
+        """Write the arrays as .npy files plus meta.json tagged with the store version"""
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name in FORECAST_ARRAYS:
+            tmp_path = os.path.join(directory, f"{name}.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, getattr(self, name))
+            os.replace(tmp_path, os.path.join(directory, f"{name}.npy"))
+        self.meta = dict(self.meta, version=FORECAST_VERSION, store_version=version, keys=self.keys,
+                         start_date=self.start_date.strftime('%Y-%m-%d'), models=list(MODELS))
+        write_json_atomic(meta_path, self.meta)
+
+    @classmethod
+    def load(cls, directory):
+        """Memory-map a saved ForecastSet, or return None if there is none"""
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta.get('version') != FORECAST_VERSION or meta.get('models') != list(MODELS):
+                return None
+            arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+                      for name in FORECAST_ARRAYS}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Forecast read error: {e}")
+            return None
+        return cls(meta['keys'], meta['start_date'], meta=meta, **arrays)
+
+
+def default_workers():
+    """Worker count from FORECAST_WORKERS, else the number of CPUs"""
+    return int(os.getenv('FORECAST_WORKERS', 0)) or os.cpu_count() or 1
+
+
+def _fit_rows(fitter, values, horizon, model, failures):
+    """Fit one series at a time so a failure only costs that series this model"""
+    point = np.full((len(values), horizon), np.nan)
+    stderr = np.full_like(point, np.nan)
+    sigma = np.full(len(values), np.nan)
+    for i in range(len(values)):
+        try:
+            point[i], stderr[i], sigma[i] = (result[0] for result in fitter(values[i:i + 1], horizon))
+        except Exception as e:
+            failures.append((i, model, f"{type(e).__name__}: {e}"))
+    return point, stderr, sigma
+
+
+def fit_block(values, horizon):
+    """Fit every model to a block of series
+
+    Returns (point, lower, upper, sigma, seconds per model, failures), where
+    failures lists (row in block, model, error) for series a model could not fit.
+    """
+    n = len(values)
+    point = np.full((n, len(MODELS), horizon), np.nan, dtype=FORECAST_DTYPE)
+    lower = np.full_like(point, np.nan)
+    upper = np.full_like(point, np.nan)
+    sigma = np.full((n, len(MODELS)), np.nan, dtype=FORECAST_DTYPE)
+    timings = {}
+    failures = []
+    for m, model in enumerate(MODELS):
+        started = time.perf_counter()
+        try:
+            with np.errstate(all='ignore'):
+                model_point, stderr, model_sigma = FITTERS[model](values, horizon)
+        except Exception:
+            model_point, stderr, model_sigma = _fit_rows(FITTERS[model], values, horizon, model, failures)
+        # Prices cannot go negative
+        point[:, m] = np.clip(model_point, 0, None)
+        lower[:, m] = np.clip(model_point - INTERVAL_Z * stderr, 0, None)
+        upper[:, m] = model_point + INTERVAL_Z * stderr
+        sigma[:, m] = model_sigma
+        timings[model] = time.perf_counter() - started
+    return point, lower, upper, sigma, timings, failures
+
+
+# Series matrix shared with pool workers, attached once per worker process
+_shared = {}
+
+
+def _attach_shared(name, shape):
+    # Spawned workers share the parent's resource tracker, so the parent's unlink
+    # is the only cleanup the block needs
+    memory = shared_memory.SharedMemory(name=name)
+    _shared['memory'] = memory
+    _shared['values'] = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+
+
+def _fit_shared_chunk(start, stop, horizon):
+    return fit_block(_shared['values'][start:stop], horizon)
+
+
+def _fit_chunks_parallel(values, chunks, horizon, workers):
+    """Yield (start, fit_block result) per chunk from a process pool over shared memory"""
+    memory = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        np.ndarray(values.shape, dtype=np.float64, buffer=memory.buf)[:] = values
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_attach_shared,
+                                 initargs=(memory.name, values.shape)) as pool:
+            futures = {pool.submit(_fit_shared_chunk, start, stop, horizon): (start, stop)
+                       for start, stop in chunks}
+            for future in as_completed(futures):
+                start, stop = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # A crashed worker costs a retry in this process, not the batch
+                    print(f"Forecast worker error for series {start}-{stop}: {e}")
+                    result = fit_block(values[start:stop], horizon)
+                yield start, result
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def fit_forecasts(series, horizon=DEFAULT_HORIZON, workers=None, chunk_series=CHUNK_SERIES, progress=None):
+    """Fit every model to every series and return a ForecastSet
+
+    Series are fitted in chunks of chunk_series rows, across a process pool
+    when workers > 1 and there are at least MIN_PARALLEL_SERIES. progress, if given,
+    is called with (series done, total series) after each chunk.
+    """
+    started = time.perf_counter()
+    n = len(series)
+    values = np.ascontiguousarray(series.values, dtype=np.float64)
+    point = np.full((n, len(MODELS), horizon), np.nan, dtype=FORECAST_DTYPE)
+    lower = np.full_like(point, np.nan)
+    upper = np.full_like(point, np.nan)
+    sigma = np.full((n, len(MODELS)), np.nan, dtype=FORECAST_DTYPE)
+    timings = dict.fromkeys(MODELS, 0.0)
+    failures = []
+
+    workers = default_workers() if workers is None else workers
+    chunks = [(start, min(start + chunk_series, n)) for start in range(0, n, chunk_series)]
+    workers = min(workers, len(chunks))
+    if workers > 1 and n >= MIN_PARALLEL_SERIES:
+        results = _fit_chunks_parallel(values, chunks, horizon, workers)
+    else:
+        workers = 1
+        results = ((start, fit_block(values[start:stop], horizon)) for start, stop in chunks)
+
+    done = 0
+    for start, (block_point, block_lower, block_upper, block_sigma, block_timings, block_failures) in results:
+        stop = start + len(block_sigma)
+        point[start:stop], lower[start:stop], upper[start:stop] = block_point, block_lower, block_upper
+        sigma[start:stop] = block_sigma
+        for model, seconds in block_timings.items():
+            timings[model] += seconds
+        failures.extend((start + row, model, error) for row, model, error in block_failures)
+        done += stop - start
+        if progress is not None:
+            progress(done, n)
+
+    scored = np.where(np.isfinite(sigma), sigma, np.inf)
+    best = np.where(np.isfinite(scored).any(axis=1), np.argmin(scored, axis=1), -1).astype(np.int8)
+    last_value = (values[:, -1] if n else np.empty(0)).astype(FORECAST_DTYPE)
+    meta = {
+        'series': n, 'history_days': int(values.shape[1]) if n else 0, 'interval_level': INTERVAL_LEVEL,
+        'workers': workers, 'chunk_series': chunk_series, 'wall_seconds': time.perf_counter() - started,
+        # Worker CPU seconds per model, and the same amortized per series
+        'fit_seconds': timings,
+        'fit_ms_per_series': {model: 1000 * seconds / n if n else 0.0 for model, seconds in timings.items()},
+        'failed_series': len({row for row, _, _ in failures}),
+        'failures': [{'series': list(series.keys[row]), 'model': model, 'error': error}
+                     for row, model, error in failures[:MAX_REPORTED_FAILURES]],
+    }
+    start_date = series.end_date + pd.Timedelta(days=1)
+    return ForecastSet(series.keys, start_date, point, lower, upper, sigma, best, last_value, meta)
+
+
+def forecast_dir(store):
+    return os.path.join(store.root, 'forecasts')
+
+
+def refresh_forecasts(store, horizon=DEFAULT_HORIZON, workers=None, progress=None):
+    """Saved forecasts for the store's current contents, refitting in one batch if it changed"""
+    directory = forecast_dir(store)
+    forecasts = ForecastSet.load(directory)
+    if forecasts is not None and forecasts.meta.get('store_version') == store.version \
+            and forecasts.horizon == horizon:
+        return forecasts
+    started = time.perf_counter()
+    series = PriceSeries.from_store(store)
+    forecasts = fit_forecasts(series, horizon, workers, progress=progress)
+    try:
+        forecasts.save(directory, store.version)
+    except OSError as e:
+        print(f"Forecast write error: {e}")
+    meta = forecasts.meta
+    print(f"Fitted forecasts for {len(series):,} price series over {meta['history_days']} days "
+          f"in {time.perf_counter() - started:.2f}s on {meta['workers']} workers")
+    if meta['failed_series']:
+        print(f"Forecast fits failed for {meta['failed_series']:,} series, first: {meta['failures'][0]}")
+    return forecasts
+
+
+def saved_forecasts(store):
+    """The last saved forecasts for a store, whatever version they were fitted on, or None"""
+    return ForecastSet.load(forecast_dir(store))
+
+
+class ForecastRefresher:
+    """PriceStore listener that refits forecasts on a background thread after each ingest
+
+    Ingests arriving during a refit trigger one more refit when it ends, so
+    the saved forecasts always catch up with the store without ever making
+    the ingesting caller wait.
+    """
+
+    def __init__(self, store, horizon=DEFAULT_HORIZON, workers=None):
+        self.store = store
+        self.horizon = horizon
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = False
+
+    def attach(self):
+        """Listen to the store and start a refit now if the saved forecasts are missing or stale"""
+        if self not in self.store.listeners:
+            self.store.listeners.append(self)
+        forecasts = saved_forecasts(self.store)
+        if self.store.parts and (forecasts is None or forecasts.meta.get('store_version') != self.store.version):
+            self.start()
+        return self
+
+    def __call__(self, rows, frame=None):
+        self.start()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                self._pending = True
+                return
+            self._thread = threading.Thread(target=self._run, name='forecast-refresh', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                refresh_forecasts(self.store, self.horizon, self.workers)
+            except Exception as e:
+                print(f"Forecast refresh error: {e}")
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+                self._pending = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='price store directory')
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON, help='days to forecast')
+    parser.add_argument('--workers', type=int, help='fitting processes (default: FORECAST_WORKERS or CPU count)')
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print(f"\rFitted {done:,}/{total:,} series", end='\n' if done == total else '', flush=True)
+
+    forecasts = refresh_forecasts(PriceStore(args.store), args.horizon, args.workers, progress)
+    print(f"{len(forecasts):,} series, models chosen: {forecasts.model_counts()}")
+    per_series = ', '.join(f"{model} {ms:.3f}" for model, ms in forecasts.meta.get('fit_ms_per_series', {}).items())
+    if per_series:
+        print(f"Fit time per series (ms): {per_series}")
+
+
+if __name__ == "__main__":
+    main()
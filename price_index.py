@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Hash index over Agmarknet price rows for the Price page lookups
+
+Maps State, (State, Commodity) and (State, Commodity, Market) to arrays of
+row positions in the price frame, so a lookup costs a dict access plus the
+size of the result instead of a boolean scan over every row.
+"""
+
+import numpy as np
+
+KEY_COLUMNS = ['State', 'Commodity', 'Market']
+
+
+def _positions(frame, columns, offset=0):
+    """Row positions (plus offset) for every distinct key of columns"""
+    groups = frame.groupby(columns, sort=False, observed=True).indices
+    if len(columns) == 1:
+        return {(key,): positions + offset for key, positions in groups.items()}
+    return {key: positions + offset for key, positions in groups.items()}
+
+
+def _extend(index, additions):
+    """Return a copy of index with the new positions appended per key"""
+    index = dict(index)
+    for key, positions in additions.items():
+        index[key] = np.concatenate([index[key], positions]) if key in index else positions
+    return index
+
+
+class PriceIndex:
+    """Row positions keyed by State, (State, Commodity) and (State, Commodity, Market)"""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.levels = [_positions(frame, KEY_COLUMNS[:depth]) for depth in range(1, len(KEY_COLUMNS) + 1)]
+        self._refresh_lists()
+
+    def _refresh_lists(self):
+        self.states = sorted(state for (state,) in self.levels[0])
+        commodities = {}
+        for state, commodity in self.levels[1]:
+            commodities.setdefault(state, []).append(commodity)
+        self.state_commodities = {state: sorted(names) for state, names in commodities.items()}
+        markets = {}
+        for state, commodity, market in self.levels[2]:
+            markets.setdefault((state, commodity), []).append(market)
+        self.commodity_markets = {key: sorted(names) for key, names in markets.items()}
+
+    def extended(self, frame, appended_from):
+        """Return an index over frame whose rows from appended_from onwards are new"""
+        index = PriceIndex.__new__(PriceIndex)
+        index.frame = frame
+        appended = frame.iloc[appended_from:]
+        index.levels = [_extend(level, _positions(appended, KEY_COLUMNS[:depth], appended_from))
+                        for depth, level in enumerate(self.levels, 1)]
+        index._refresh_lists()
+        return index
+
+    def positions(self, state, commodity=None, market=None):
+        """Row positions for a state, optionally narrowed to a commodity and market"""
+        key = tuple(part for part in (state, commodity, market) if part is not None)
+        return self.levels[len(key) - 1].get(key, np.empty(0, dtype=np.intp))
+
+    def rows(self, state, commodity=None, market=None):
+        """Price rows for a state, optionally narrowed to a commodity and market"""
+        return self.frame.iloc[self.positions(state, commodity, market)]
+
+    def has_state(self, state):
+        return (state,) in self.levels[0]
+
+    def commodities(self, state):
+        """Sorted commodities with price rows in a state"""
+        return self.state_commodities.get(state, [])
+
+    def markets(self, state, commodity):
+        """Markets with price rows for a commodity in a state"""
+        return self.commodity_markets.get((state, commodity), [])
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Append-only historical price store partitioned by arrival date and state
+
+Each ingested Agmarknet snapshot is split into one immutable part file per
+(Arrival_Date, State) under date=YYYY-MM-DD/state=<State>/, and a manifest
+records every part with its row count and commodities. Range queries pick
+parts from the manifest alone, so "commodity X in state Y between dates A
+and B" reads only the files for those days and that state.
+
+Several processes may share a store (the app and the ingest CLIs): each
+ingest holds an exclusive lock file in the store root and re-reads the
+manifest under it, and readers reload the manifest when it changes on disk.
+
+    python price_store.py ingest agmarknet_prices.csv
+    python price_store.py query --state Punjab --commodity Wheat --start 2025-09-01
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    fcntl = None
+    FCNTL_AVAILABLE = False
+
+from crop_data import file_digest, write_json_atomic
+from price_data import (ARRIVAL_DATE_FORMAT, NATURAL_KEY, PRICE_COLUMNS, PRICE_DTYPES, compact_price_frame,
+                        read_price_csv, row_hashes)
+
+DEFAULT_STORE_PATH = 'price_store'
+LOCK_FILE = 'ingest.lock'
+MANIFEST_VERSION = 1
+PARTITION_DATE_FORMAT = '%Y-%m-%d'
+PART_DTYPES = {column: dtype for column, dtype in PRICE_DTYPES.items() if column in PRICE_COLUMNS}
+
+
+def _state_slug(state):
+    """Filesystem-safe directory name for a state"""
+    return re.sub(r'[^A-Za-z0-9]+', '_', str(state)).strip('_') or 'unknown'
+
+
+def _as_date(value):
+    """Accept a date, datetime, Timestamp or YYYY-MM-DD string"""
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    return pd.Timestamp(value).date()
+
+
+class PriceStore:
+    """Date- and state-partitioned store of Agmarknet price rows
+
+    Parts are never rewritten: ingesting a new snapshot only adds files, and
+    a snapshot whose SHA-256 was already ingested is skipped. A sorted array
+    of natural-key and price hashes for every stored row lets ingestion write
+    only rows that are new or whose prices changed; a changed row supersedes
+    the earlier one in queries.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_PATH):
+        self.root = root
+        self._lock = threading.RLock()
+        self.listeners = []
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self.sources = {}
+        self.parts = []
+        self.row_hash_file = None
+        self._row_hashes = None
+        self._manifest_stat = None
+        self._load_manifest()
+
+    def _stat_manifest(self):
+        """(inode, mtime, size) of manifest.json, or None before the first ingest"""
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load_manifest(self):
+        """Read manifest.json if it changed on disk since it was last read; returns whether it did"""
+        stat = self._stat_manifest()
+        if stat is None or stat == self._manifest_stat:
+            return False
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported price store version {manifest.get('version')} in {self.root}")
+        self.sources = manifest['sources']
+        self.parts = manifest['parts']
+        if manifest.get('row_hashes') != self.row_hash_file:
+            self._row_hashes = None
+        self.row_hash_file = manifest.get('row_hashes')
+        self._manifest_stat = stat
+        self._refresh_partitions()
+        return True
+
+    def refresh(self):
+        """Pick up ingests other processes made since the manifest was last read; returns whether there were any"""
+        with self._lock:
+            return self._load_manifest()
+
+    @contextmanager
+    def _ingest_lock(self):
+        """Exclusive lock on the store across processes (threads of one process share self._lock)"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), 'a') as f:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_row_hashes(self):
+        """(sorted key hashes, price hashes) of the stored rows, rebuilt from the parts if missing"""
+        if self._row_hashes is None:
+            if self.row_hash_file:
+                stored = np.load(os.path.join(self.root, self.row_hash_file))
+                self._row_hashes = stored[0], stored[1]
+            else:
+                keys, values = row_hashes(self.query()) if self.parts else (np.empty(0, np.uint64),) * 2
+                order = np.argsort(keys, kind='stable')
+                self._row_hashes = keys[order], values[order]
+        return self._row_hashes
+
+    def _save_row_hashes(self, keys, values):
+        """Write a new hash file; the manifest written next makes it current"""
+        name = f"row_hashes-{len(self.sources):06d}.npy"
+        tmp_path = os.path.join(self.root, f"{name}.{os.getpid()}.tmp.npy")
+        np.save(tmp_path, np.stack([keys, values]))
+        os.replace(tmp_path, os.path.join(self.root, name))
+        return name
+
+    def _refresh_partitions(self):
+        """Group parts by date so range lookups are a bisect over sorted dates"""
+        partitions = {}
+        for part in self.parts:
+            partitions.setdefault(part['date'], []).append(part)
+        self.dates = sorted(partitions)
+        self._partitions = partitions
+
+    def _save_manifest(self):
+        write_json_atomic(self.manifest_path, {
+            'version': MANIFEST_VERSION, 'sources': self.sources, 'parts': self.parts,
+            'row_hashes': self.row_hash_file})
+        self._manifest_stat = self._stat_manifest()
+
+    @property
+    def version(self):
+        """Token that changes whenever ingestion writes rows, here or in another process"""
+        self.refresh()
+        return hashlib.sha256('\n'.join(part['file'] for part in self.parts).encode()).hexdigest()[:16]
+
+    def ingest(self, path):
+        """Add a daily snapshot CSV to the store; returns the ingest_frame stats"""
+        return self.ingest_frame(read_price_csv(path), file_digest(path), path)
+
+    def diff(self, frame):
+        """Split compact price rows against the store into (inserted, changed, skipped) masks"""
+        keys, values = row_hashes(frame)
+        stored_keys, stored_values = self._load_row_hashes()
+        # Within the frame the last row for a key wins, as it would on a second ingest
+        repeated = pd.Series(keys).duplicated(keep='last').to_numpy()
+        found = np.searchsorted(stored_keys, keys)
+        known = found < len(stored_keys)
+        known[known] = stored_keys[found[known]] == keys[known]
+        same = np.zeros(len(frame), dtype=bool)
+        same[known] = stored_values[found[known]] == values[known]
+        return ~known & ~repeated, known & ~same & ~repeated, same | repeated
+
+    def ingest_frame(self, frame, source_id, source_name=None):
+        """Add compact price rows identified by source_id (e.g. a file SHA-256)
+
+        Only rows that are new, or whose prices changed, are written. Returns
+        a dict with 'added', 'changed' and 'skipped' counts and 'delta', the
+        written rows, for downstream aggregates; everything is skipped if
+        source_id was ingested before. Each callable in listeners is then
+        called with the written rows and the whole frame.
+        """
+        with self._lock, self._ingest_lock():
+            # Another process may have ingested since the manifest was read; merge onto its state
+            self._load_manifest()
+            stats = {'added': 0, 'changed': 0, 'skipped': len(frame), 'delta': frame.iloc[:0]}
+            if source_id in self.sources or frame.empty:
+                return stats
+            inserted, changed, skipped = self.diff(frame)
+            delta = frame[inserted | changed]
+            written = []
+            # Ingest sequence plus a full hash of the source id, so no two ingests share a part path
+            token = f"{len(self.sources):06d}-{hashlib.sha256(source_id.encode()).hexdigest()}"
+            groups = delta.groupby(['Arrival_Date', 'State'], observed=True, sort=True).indices if len(delta) else {}
+            for (arrival, state), positions in groups.items():
+                rows = delta.iloc[positions]
+                day = arrival.strftime(PARTITION_DATE_FORMAT)
+                directory = os.path.join(f"date={day}", f"state={_state_slug(state)}")
+                os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+                relative = os.path.join(directory, f"part-{token}.csv")
+                target = os.path.join(self.root, relative)
+                rows.to_csv(f"{target}.tmp", index=False, date_format=ARRIVAL_DATE_FORMAT)
+                # Parts are immutable: linking fails rather than replace a part another ingest wrote
+                try:
+                    os.link(f"{target}.tmp", target)
+                finally:
+                    os.remove(f"{target}.tmp")
+                written.append({'date': day, 'state': state, 'file': relative, 'rows': len(rows),
+                                'changed': int(changed[inserted | changed][positions].sum()),
+                                'commodities': sorted(rows['Commodity'].unique().tolist())})
+
+            stats = {'added': int(inserted.sum()), 'changed': int(changed.sum()), 'skipped': int(skipped.sum()),
+                     'delta': delta}
+            self.sources[source_id] = dict({key: stats[key] for key in ('added', 'changed', 'skipped')},
+                                           name=source_name, rows=len(frame),
+                                           ingested_at=datetime.now().isoformat(timespec='seconds'))
+            previous_hash_file = self.row_hash_file
+            if len(delta):
+                keys, values = row_hashes(delta)
+                stored_keys, stored_values = self._load_row_hashes()
+                stored_values = stored_values.copy()
+                found = np.searchsorted(stored_keys, keys)
+                update = changed[inserted | changed]
+                stored_values[found[update]] = values[update]
+                keys = np.concatenate([stored_keys, keys[~update]])
+                order = np.argsort(keys, kind='stable')
+                self._row_hashes = keys[order], np.concatenate([stored_values, values[~update]])[order]
+                self.row_hash_file = self._save_row_hashes(*self._row_hashes)
+            self.parts.extend(written)
+            # Parts and hashes are written before the manifest, so a crash leaves only unreferenced files
+            self._save_manifest()
+            self._refresh_partitions()
+            if previous_hash_file and previous_hash_file != self.row_hash_file:
+                os.remove(os.path.join(self.root, previous_hash_file))
+        # Listeners see only the written rows, after the manifest is committed
+        if len(delta):
+            for listener in self.listeners:
+                listener(delta, frame)
+        return stats
+
+    def ingest_price_data(self, price_data):
+        """Add a loaded PriceData snapshot, keyed by its file hash"""
+        return self.ingest_frame(price_data.frame, price_data.sha256, price_data.path)
+
+    def select_parts(self, state=None, commodity=None, start=None, end=None):
+        """Manifest entries that can hold rows matching the filters"""
+        self.refresh()
+        start, end = _as_date(start), _as_date(end)
+        low = 0 if start is None else bisect.bisect_left(self.dates, start.strftime(PARTITION_DATE_FORMAT))
+        high = len(self.dates) if end is None else bisect.bisect_right(self.dates, end.strftime(PARTITION_DATE_FORMAT))
+        return [part for day in self.dates[low:high] for part in self._partitions[day]
+                if (state is None or part['state'] == state)
+                and (commodity is None or commodity in part['commodities'])]
+
+    def query(self, state=None, commodity=None, start=None, end=None, market=None):
+        """Price rows for the filters between start and end dates inclusive, oldest first"""
+        frames = []
+        parts = self.select_parts(state, commodity, start, end)
+        for part in parts:
+            # Parts are small, so dictionary-encode and parse dates once over the concatenation
+            rows = pd.read_csv(os.path.join(self.root, part['file']), dtype=PART_DTYPES)
+            if commodity is not None:
+                rows = rows[rows['Commodity'] == commodity]
+            if market is not None:
+                rows = rows[rows['Market'] == market]
+            frames.append(rows)
+        if not frames:
+            return pd.DataFrame()
+        frame = compact_price_frame(pd.concat(frames, ignore_index=True))
+        if any(part.get('changed') for part in parts):
+            # Parts are in ingest order within a date, so the latest price of a changed row wins
+            frame = frame.drop_duplicates(NATURAL_KEY, keep='last')
+        return frame.sort_values('Arrival_Date', kind='stable').reset_index(drop=True)
+
+    def daily_prices(self, state, commodity, start=None, end=None, market=None):
+        """Mean min/max/modal price per arrival date, indexed by date"""
+        rows = self.query(state, commodity, start, end, market)
+        if rows.empty:
+            return pd.DataFrame(columns=PRICE_COLUMNS)
+        return rows.groupby('Arrival_Date')[PRICE_COLUMNS].mean()
+
+    def describe(self):
+        """One-line summary of the store for display"""
+        self.refresh()
+        rows = sum(part['rows'] for part in self.parts)
+        span = f", {self.dates[0]} to {self.dates[-1]}" if self.dates else ''
+        return f"{rows:,} stored price rows over {len(self.dates)} days in {len(self.parts)} partitions{span}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='store directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help='add daily snapshot CSVs to the store')
+    ingest.add_argument('paths', nargs='+')
+    query = commands.add_parser('query', help='print rows for a state, commodity and date range')
+    query.add_argument('--state')
+    query.add_argument('--commodity')
+    query.add_argument('--market')
+    query.add_argument('--start', help='first arrival date, YYYY-MM-DD')
+    query.add_argument('--end', help='last arrival date, YYYY-MM-DD')
+    args = parser.parse_args()
+
+    store = PriceStore(args.store)
+    if args.command == 'ingest':
+        version = store.version
+        for path in args.paths:
+            started = time.perf_counter()
+            stats = store.ingest(path)
+            print(f"{path}: {stats['added']:,} added, {stats['changed']:,} changed, {stats['skipped']:,} skipped "
+                  f"in {time.perf_counter() - started:.2f}s")
+        print(store.describe())
+        if store.version != version:
+            # Imported here: price_forecast builds on this module
+            from price_forecast import refresh_forecasts
+            refresh_forecasts(store)
+    else:
+        started = time.perf_counter()
+        parts = store.select_parts(args.state, args.commodity, args.start, args.end)
+        rows = store.query(args.state, args.commodity, args.start, args.end, args.market)
+        print(rows.to_string(index=False) if len(rows) else 'No matching rows')
+        print(f"{len(rows):,} rows from {len(parts)} of {len(store.parts)} partitions "
+              f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
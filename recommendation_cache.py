@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Bounded LRU/TTL cache for crop recommendations, shared through SQLite
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from crop_data import file_fingerprint
+
+DEFAULT_CACHE_PATH = os.path.join('.cache', 'recommendations.sqlite')
+COUNTERS = ('hits', 'misses', 'evictions', 'expirations', 'invalidations')
+
+
+def quantize_conditions(N, P, K, temperature, humidity, ph, rainfall):
+    """Snap inputs to the slider grid: whole units, and 0.1 steps for pH"""
+    return (int(round(N)), int(round(P)), int(round(K)), int(round(temperature)),
+            int(round(humidity)), round(float(ph), 1), int(round(rainfall)))
+
+
+class RecommendationCache:
+    """Cross-session, cross-process cache of recommend_crop results
+
+    Entries live in a SQLite file so every Streamlit session and worker
+    process shares them. The least recently used entries are evicted past
+    max_entries, entries older than ttl_seconds are dropped on read, and
+    everything is invalidated when the source CSV changes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, source='crop_recommendation.csv',
+                 max_entries=10000, ttl_seconds=24 * 3600):
+        self.path = path
+        self.source = source
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, version TEXT NOT NULL, '
+            'created REAL NOT NULL, last_used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._conn.executemany('INSERT OR IGNORE INTO counters VALUES (?, 0)', [(name,) for name in COUNTERS])
+        self._version = None
+
+    @staticmethod
+    def make_key(N, P, K, temperature, humidity, ph, rainfall, state, k=3, distinct=False):
+        """Cache key for quantized inputs plus state"""
+        return json.dumps([*quantize_conditions(N, P, K, temperature, humidity, ph, rainfall), state, k, distinct])
+
+    def _bump(self, name, amount=1):
+        if amount:
+            self._conn.execute('UPDATE counters SET value = value + ? WHERE name = ?', (amount, name))
+
+    def _check_version(self):
+        """Drop entries computed from an older copy of the source CSV"""
+        version = json.dumps(file_fingerprint(self.source))
+        if version != self._version:
+            removed = self._conn.execute('DELETE FROM entries WHERE version != ?', (version,)).rowcount
+            self._bump('invalidations', removed)
+            self._version = version
+        return version
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            version = self._check_version()
+            now = time.time()
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Entries from another version (written by a process that has not seen the change) are misses
+                row = self._conn.execute('SELECT value, created FROM entries WHERE key = ? AND version = ?',
+                                         (key, version)).fetchone()
+                if row is not None and now - row[1] > self.ttl_seconds:
+                    self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    self._bump('expirations')
+                    row = None
+                if row is None:
+                    self._bump('misses')
+                else:
+                    self._conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (now, key))
+                    self._bump('hits')
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key, value):
+        """Store value under key, evicting least recently used entries past the bound"""
+        with self._lock:
+            version = self._check_version()
+            now = time.time()
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                                   (key, json.dumps(value), version, now, now))
+                excess = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0] - self.max_entries
+                if excess > 0:
+                    self._conn.execute(
+                        'DELETE FROM entries WHERE key IN '
+                        '(SELECT key FROM entries ORDER BY last_used LIMIT ?)', (excess,))
+                    self._bump('evictions', excess)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def recommend(self, recommender, N, P, K, temperature, humidity, ph, rainfall, state, k=3, distinct=False):
+        """Return recommender.recommend(...) for the quantized inputs, cached"""
+        key = self.make_key(N, P, K, temperature, humidity, ph, rainfall, state, k, distinct)
+        cached = self.get(key)
+        if cached is not None:
+            return tuple(cached)
+        conditions = quantize_conditions(N, P, K, temperature, humidity, ph, rainfall)
+        result = recommender.recommend(*conditions, state, k, distinct)
+        self.put(key, list(result))
+        return result
+
+    def stats(self):
+        """Return shared hit/miss/eviction counters and the current entry count"""
+        with self._lock:
+            stats = dict(self._conn.execute('SELECT name, value FROM counters').fetchall())
+            stats['entries'] = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """Remove every entry and reset the counters"""
+        with self._lock:
+            self._conn.execute('DELETE FROM entries')
+            self._conn.execute('UPDATE counters SET value = 0')